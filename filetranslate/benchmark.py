@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark
+~~~~~~~~~
+
+Micro-benchmarks of the hot paths on synthetic data.
+
+Usage: python benchmark.py [name ...]  (all benchmarks by default)
+"""
+__version__ = '0.1.0'
+
+import os, sys, re, random, time, argparse, functools
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = dict()
+KANA = ''.join(chr(c) for c in range(ord('ぁ'), ord('ゖ'))) + ''.join(chr(c) for c in range(ord('ァ'), ord('ヺ')))
+KANJI = ''.join(chr(c) for c in range(0x4E00, 0x4E00 + 500))
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__.replace("bench_", '')] = fn
+    return fn
+
+
+def timed(fn, *args, repeat=3):
+    """ Returns (best time in seconds, result) """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def random_text(rnd, min_len, max_len, alphabet=KANA + KANJI):
+    return ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(min_len, max_len)))
+
+
+def report(title, old_time, new_time, same):
+    print(f"{title}: old {old_time * 1000:.1f}ms, new {new_time * 1000:.1f}ms, "
+          f"x{old_time / max(new_time, 1e-9):.1f}{'' if same else ', RESULTS DIFFER'}")
+
+
+@benchmark
+def bench_dictionary(n_entries=2000, n_batches=50, batch_chars=2000):
+    """ translation_dictionary_in applied to MTL batches """
+    from dictionary_fn import ReplacementDictionary
+    rnd = random.Random(0)
+    entries = []
+    for i in range(n_entries):
+        if i % 100 == 99:
+            entries.append([random_text(rnd, 1, 2) + r'(\d+)', r'\1'])
+        else:
+            key = random_text(rnd, 2, 6)
+            entries.append([key, key + f"[name{i}]"])
+    keys = [e[0] for e in entries if '(' not in e[0]]
+    batches = []
+    for _ in range(n_batches):
+        words = []
+        while sum(map(len, words)) < batch_chars:
+            words.append(rnd.choice(keys) if rnd.random() < 0.2 else random_text(rnd, 1, 10))
+            if rnd.random() < 0.05: words.append('\n')
+        batches.append(''.join(words))
+
+    def old(batches):
+        out = []
+        for text in batches:
+            for dict_line in entries:
+                text = re.sub(dict_line[0], dict_line[1], text, flags=re.U)
+            out.append(text)
+        return out
+
+    def new(batches):
+        d = ReplacementDictionary(entries, re.U)
+        return [d.sub(text) for text in batches]
+
+    old_time, old_result = timed(old, batches, repeat=1)
+    new_time, new_result = timed(new, batches)
+    report(f"dictionary ({n_entries} entries, {n_batches}x{batch_chars} chars)", old_time, new_time, old_result == new_result)
+
+
+@benchmark
+def bench_out_dictionary(n_entries=300, n_rows=20000):
+    """ translation_dictionary_out applied to translated rows (-fix, -a with mode 4) """
+    from dictionary_fn import OutDictionary
+    rnd = random.Random(0)
+    words = ["Alice", "Bob", "colour", "honour", "Mr", "Mrs", "sword", "potion", "yen", "gold"]
+    entries = [[f"{rnd.choice(words)}{i}", f"W{i}"] for i in range(n_entries)]
+    entries += [[r'(\d+) yen', r'\1 G'], [r'^Mr ', 'Mr. '], [r'\s+$', '']]
+    rows = [' '.join(rnd.choice(words) + (str(rnd.randrange(n_entries)) if rnd.random() < 0.2 else '')
+                     for _ in range(rnd.randint(3, 12))) for _ in range(n_rows)]
+
+    def old(rows):
+        return [functools.reduce(lambda text, e: re.sub(e[0], e[1], text, flags=re.M), entries, row) for row in rows]
+
+    def new(rows):
+        out_dict = OutDictionary(entries)
+        return [out_dict.sub(row, multiline=True) for row in rows]
+
+    old_time, old_result = timed(old, rows, repeat=1)
+    new_time, new_result = timed(new, rows)
+    report(f"out dictionary ({n_entries} entries, {n_rows} rows)", old_time, new_time, old_result == new_result)
+
+
+def _old_separate_tags_and_sentence(sentence, tags, all_tags):
+    # separate_tags_and_sentence before TagSplitter (without the sfx fix)
+    import filetranslate as ft
+    starttag = ''
+    endtag = ''
+    for i in tags:
+        if re.match(r'^[ \u3000]+$', i[0]) and re.match(f'^{i[0]}', sentence):
+            starttag = i[0]
+            sentence = re.sub(f'^{i[0]}', '', sentence)
+    for _ in range(ft.MAX_BORDER_TAGS):
+        starttag_r = re.compile('^' + all_tags).search(sentence)
+        if starttag_r:
+            starttag = starttag + starttag_r[0]
+            sentence = sentence.replace(starttag_r[0], '')
+            continue
+        endtag_r = re.compile(all_tags + '$').search(sentence)
+        if endtag_r:
+            endtag = endtag_r[0] + endtag
+            sentence = sentence.replace(endtag_r[0], '')
+            continue
+    for i in tags:
+        if re.match(r'^[ \u3000]+$', i[0]): continue
+        sentence = sentence.replace(i[0], i[1])
+    return [starttag or None, sentence, endtag or None]
+
+
+@benchmark
+def bench_tag_splitter(n_lines=50000, n_tags=1000):
+    """ split_reader_to_array tag splitting with a big replacement_tags.csv """
+    import filetranslate as ft
+    ft.ENABLE_SFX_TO_ROMAJI = False
+    rnd = random.Random(0)
+    tags = [['\u3000', ''], ['  ', '']]
+    kinds = ['\\c[{}]', '\\V[{}]', '<t{}>', '{{{}}}', '\\n<{}>', '@{}@']
+    while len(tags) < n_tags:
+        tag = rnd.choice(kinds).format(len(tags))
+        tags.append([tag, f"[{len(tags)}]"])
+    lines = []
+    for _ in range(n_lines):
+        parts = [rnd.choice(tags)[0] for _ in range(rnd.randint(0, 2))]
+        parts.append(random_text(rnd, 2, 20))
+        for _ in range(rnd.randint(0, 3)):
+            parts.append(rnd.choice(tags)[0] if rnd.random() < 0.5 else random_text(rnd, 1, 10))
+        lines.append(''.join(parts))
+
+    def old(lines):
+        all_tags = ft.make_all_tags_re(tags)
+        return [_old_separate_tags_and_sentence(line, tags, all_tags) for line in lines]
+
+    def new(lines):
+        splitter = ft.TagSplitter(tags)
+        return [splitter.split(line) for line in lines]
+
+    old_time, old_result = timed(old, lines, repeat=1)
+    new_time, new_result = timed(new, lines)
+    report(f"tag splitter ({n_lines} lines, {n_tags} tags)", old_time, new_time, old_result == new_result)
+
+
+@benchmark
+def bench_indexed_rows(n_rows=50000):
+    """ Memory and parse cache size of the indexed array: nested lists vs IndexedRow """
+    import pickle, tracemalloc
+    import filetranslate as ft
+    rnd = random.Random(0)
+    tags = [[f"\\c[{n}]", f"[c{n}]"] for n in range(10)] + [["\\n<\\N[1]>", "[name]"], ["\\|", "[w]"]]
+    rows = []
+    for _ in range(n_rows):
+        lines = []
+        for _ in range(rnd.choice([1, 1, 1, 2, 3])):
+            line = random_text(rnd, 4, 30) + '。'
+            if rnd.random() < 0.3: line = rnd.choice(tags)[0] + line
+            if rnd.random() < 0.2: line += rnd.choice(tags)[0]
+            lines.append(line)
+        rows.append(['\n'.join(lines), '', "context" if rnd.random() < 0.5 else ''])
+    splitter = ft.TagSplitter(tags)
+    ft.set_progress_enabled(False)
+
+    def measure(make):
+        tracemalloc.start()
+        result = make()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)), result
+
+    def old():
+        # split_reader_to_array before IndexedRow
+        return [[i, len(row[0].splitlines()), row[0], [splitter.split(a) for a in row[0].splitlines()]] + row[1:]
+                for i, row in enumerate(rows)]
+
+    old_mem, old_pickle, old_rows = measure(old)
+    new_mem, new_pickle, new_rows = measure(lambda: ft.split_reader_to_array(rows, splitter))
+    ft.set_progress_enabled(True)
+    same = old_rows == new_rows and pickle.loads(pickle.dumps(new_rows)) == new_rows
+    print(f"indexed rows ({n_rows} rows): memory lists {old_mem / 1024**2:.1f} MiB, IndexedRow {new_mem / 1024**2:.1f} MiB; " +
+          f"pickle lists {old_pickle / 1024**2:.1f} MiB, IndexedRow {new_pickle / 1024**2:.1f} MiB" +
+          ('' if same else ", RESULTS DIFFER"))
+
+
+@benchmark
+def bench_unreplace_tags(n_rows=20000, n_tags=1000):
+    """ -fix: MTL tags of translations back to the originals """
+    from language_fn import unreplace_tags, tag_hash, TagUnreplacer
+    rnd = random.Random(0)
+    tags = []
+    for n in range(n_tags):
+        orig = f"\\C[{n}]" if n % 2 else random_text(rnd, 2, 6)
+        tags.append([orig, tag_hash(orig + str(n))])
+    words = "the a of to and he she it was is in that for on with as you at".split()
+    rows = []
+    for _ in range(n_rows):
+        parts = [rnd.choice(words) for _ in range(rnd.randint(3, 15))]
+        for _ in range(rnd.randint(0, 3)):
+            tag = rnd.choice(tags)[1]
+            parts.insert(rnd.randrange(len(parts) + 1), rnd.choice([tag, tag.upper(), tag.capitalize(), tag[:-1]]))
+        rows.append(' '.join(parts))
+
+    def old(rows):
+        return [unreplace_tags(row, tags) for row in rows]
+
+    def new(rows):
+        unreplacer = TagUnreplacer(tags)
+        return [unreplacer.sub(row) for row in rows]
+
+    old_time, old_result = timed(old, rows, repeat=1)
+    new_time, new_result = timed(new, rows)
+    report(f"unreplace tags ({n_rows} rows, {n_tags} tags)", old_time, new_time, old_result == new_result)
+
+
+@benchmark
+def bench_apply_segments(n_segments=100000, repeat_ratio=0.3, stale_ratio=0.005):
+    """ -a: placing database rows into a split script """
+    from filetranslate import index_segments
+    rnd = random.Random(0)
+    re_s = re.compile(r'^text "(.*)"$', re.MULTILINE)
+    common = [random_text(rnd, 4, 20) for _ in range(200)]
+    lines = [rnd.choice(common) if rnd.random() < repeat_ratio else random_text(rnd, 4, 30)
+             for _ in range(n_segments // 2)]
+    segments = re_s.split(''.join(f'text "{line}"\n' for line in lines))
+    rows = list(dict.fromkeys(lines)) # database has every string once, in file order
+    for _ in range(int(len(rows) * stale_ratio)): # strings removed by a game update
+        rows.insert(rnd.randrange(len(rows) + 1), random_text(rnd, 4, 30))
+    rows = [[row, "EN:" + row] for row in rows]
+
+    def old(segments):
+        segments = segments[:]
+        last_pos = 0
+        for row in rows:
+            for i in range(last_pos, len(segments)):
+                if segments[i] == '"' or segments[i] == "'": continue
+                if segments[i] == row[0]:
+                    segments[i] = row[1]
+                    last_pos = max(0, i - 10 * re_s.groups)
+                    break
+        return segments
+
+    def new(segments):
+        segments = segments[:]
+        positions = index_segments(segments)
+        for row in rows:
+            queue = positions.get(row[0])
+            if queue:
+                segments[queue.popleft()] = row[1]
+        return segments
+
+    old_time, old_result = timed(old, segments, repeat=1)
+    new_time, new_result = timed(new, segments)
+    report(f"apply segments ({len(segments)} segments, {len(rows)} rows)", old_time, new_time, old_result == new_result)
+
+
+@benchmark
+def bench_attribute_lookup(n_rows=5000, n_matches=20000):
+    """ -a: attribute translations of regexp matches """
+    from filetranslate import make_attribute_lookups, sort_by_first_column_length, COMMENT_TAG
+    rnd = random.Random(0)
+    alines = sort_by_first_column_length([[random_text(rnd, 2, 12), "EN"] for _ in range(n_rows)])
+    found = [rnd.choice(alines)[0] if rnd.random() < 0.9 else random_text(rnd, 2, 12) for _ in range(n_matches)]
+
+    def old(found):
+        result = []
+        for item in found:
+            for row in alines:
+                if row[0][:len(COMMENT_TAG)] == COMMENT_TAG and row[1][:len(COMMENT_TAG)] != COMMENT_TAG: continue
+                if item == row[0]:
+                    if not row[1]: break
+                    item = row[1]
+            result.append(item)
+        return result
+
+    def new(found):
+        block_lookup, _ = make_attribute_lookups(alines)
+        return [block_lookup.get(item, item) for item in found]
+
+    old_time, old_result = timed(old, found, repeat=1)
+    new_time, new_result = timed(new, found)
+    report(f"attribute lookup ({n_rows} rows, {n_matches} matches)", old_time, new_time, old_result == new_result)
+
+
+@benchmark
+def bench_binary_patch(size_mb=10, n_strings=5000):
+    """ -a of a binary: translated strings patched into an executable """
+    from binary_fn import BinaryPatcher
+    rnd = random.Random(0)
+    strings = list(dict.fromkeys(random_text(rnd, 2, 20).encode("utf-8") + b'\0' for _ in range(n_strings)))
+    chunks, size = [], 0
+    while size < size_mb * 1024 * 1024:
+        chunks.append(rnd.choice(strings) if rnd.random() < 0.05 else rnd.randbytes(rnd.randint(16, 512)))
+        size += len(chunks[-1])
+    data = b''.join(chunks)
+    patches = sorted(((s, b'X' * (len(s) - 1) + b'\0') for s in strings), key=lambda p: len(p[0]), reverse=True)
+
+    def old(data):
+        for original, replacement in patches:
+            data = data.replace(original, replacement, 1)
+        return data
+
+    def new(data):
+        patcher = BinaryPatcher(data)
+        for original, replacement in patches:
+            patcher.add(original, replacement)
+        patcher.apply()
+        return bytes(patcher.data)
+
+    old_time, old_result = timed(old, data, repeat=1)
+    new_time, new_result = timed(new, data, repeat=1)
+    report(f"binary patch ({size_mb} MiB, {len(patches)} strings)", old_time, new_time, old_result == new_result)
+
+
+def make_project(work_dir, rnd, n_files, n_rows, repeat_ratio=0.1):
+    """ Writes synthetic untranslated _strings.csv databases; returns their names """
+    from service_fn import write_csv_list
+    common = [random_text(rnd, 4, 20) + '。' for _ in range(50)]
+    file_names = []
+    for n in range(n_files):
+        rows = []
+        for _ in range(n_rows):
+            if rnd.random() < repeat_ratio:
+                text = rnd.choice(common)
+            else:
+                text = random_text(rnd, 4, 40) + rnd.choice(['。', '！', '？', '、', '…'])
+                if rnd.random() < 0.1:
+                    text += '\n' + random_text(rnd, 4, 20) + '。'
+            rows.append([text, ''])
+        file_names.append(os.path.join(work_dir, f"file{n:03d}_strings.csv"))
+        write_csv_list(file_names[-1], rows)
+    return file_names
+
+
+@benchmark
+def bench_pipeline(n_files=20, n_rows=300, latency=0.05, jobs=4):
+    """ translateCSV with the mock backend on a synthetic project """
+    import tempfile, shutil
+    from concurrent.futures import ThreadPoolExecutor
+    import filetranslate as ft
+    from mocktranslate import MockTranslate
+    from translation_memory import TranslationMemory
+    from service_fn import set_progress_enabled
+
+    ft.ENABLE_CACHE = False # parse cache isn't measured
+    set_progress_enabled(False)
+    old_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(work_dir)
+        rnd = random.Random(0)
+        file_names = make_project(work_dir, rnd, n_files, n_rows)
+        originals = {fn: open(fn, 'rb').read() for fn in file_names}
+        FT = ft.FileTranslate(work_dir=work_dir, img_exts=[], file_enc='utf-8', re_a=None, re_s=None, re_t=None,
+                              re_a_sep=None, re_excl=None, re_mque=None)
+        store = dict() # shared by the runs to measure translation memory hits
+        for title, n_jobs in [("sequential", 1), (f"{jobs} jobs", jobs), ("memory hits", jobs)]:
+            if title != "memory hits":
+                store.clear()
+            for fn, data in originals.items():
+                with open(fn, 'wb') as f: f.write(data)
+            backend = MockTranslate(latency=latency)
+            memory = TranslationMemory(store, backend.name, "JA-EN")
+            start = time.perf_counter()
+            with ft.TranslationService(backend, work_dir, memory=memory) as trn_svc:
+                with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+                    n_translated = sum(pool.map(lambda fn: FT.translateCSV(trn_svc, fn, True), file_names))
+            elapsed = time.perf_counter() - start
+            print(f"pipeline {title} ({n_files}x{n_rows} rows, {latency * 1000:.0f}ms/request): " +
+                  f"{elapsed:.2f}s, {n_translated / elapsed:.0f} rows/s, {backend.requests} requests, " +
+                  f"{backend.chars} chars, {memory.hits} memory hits")
+    finally:
+        os.chdir(old_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        set_progress_enabled(True)
+
+
+SUGOI_CORPUS = [
+    "おはようございます。今日はいい天気ですね。",
+    "この扉を開けるには鍵が必要だ。",
+    "……まさか、あなたが犯人だったなんて。",
+    "村の外れに古い神社があるらしい。",
+    "お腹が空いたから、何か食べに行こうよ！",
+    "気をつけて。この先には魔物がたくさんいる。",
+    "ありがとう、助かったよ。",
+    "王様がお呼びです。すぐに城へ向かってください。",
+    "え？ 何を言っているのか分からないよ。",
+    "宝箱を開けた。ポーションを手に入れた！",
+    "もう少しだけ、ここにいてもいいかな？",
+    "彼女は毎朝、図書館で本を読んでいる。",
+    "この剣は伝説の鍛冶屋が作ったものだ。",
+    "雨が止むまで、少し休んでいこう。",
+    "セーブしますか？",
+    "昨日の約束、覚えてる？",
+    "敵の数が多すぎる！ 一旦引くぞ！",
+    "ここから先は通さない。",
+    "お母さんに手紙を書こうと思うんだ。",
+    "すみません、道に迷ってしまいました。",
+]
+
+
+def peak_rss_mb():
+    """ Returns peak resident memory of this process in MiB (None if unknown) """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    except (ImportError, AttributeError):
+        return None
+
+
+def _sugoi_run(quantize, corpus, repeat):
+    """ Translates corpus in a fresh process; returns (seconds, translations, peak RSS) """
+    from sugoitranslate import SugoiTranslate
+    with SugoiTranslate(by_line=True, quantize=quantize) as sugoi:
+        sugoi.translate_lines_batched(corpus[:2]) # warm-up
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = sugoi.translate_lines_batched(corpus)
+        elapsed = time.perf_counter() - start
+    return elapsed, result, peak_rss_mb()
+
+
+@benchmark
+def bench_sugoi_quantized(repeat=5):
+    """ Sugoi fp32 vs dynamic int8: sentences/s, peak RSS and output drift """
+    import difflib, multiprocessing
+    try:
+        import fairseq
+    except ImportError:
+        print("sugoi_quantized: skipped, fairseq isn't installed")
+        return
+    corpus = SUGOI_CORPUS * 3
+    results = dict()
+    # each mode runs in its own process so peak memory isn't shared
+    ctx = multiprocessing.get_context("spawn")
+    for quantize in (False, True):
+        with ctx.Pool(1) as pool:
+            results[quantize] = pool.apply(_sugoi_run, (quantize, corpus, repeat))
+    for quantize, (elapsed, _, rss) in results.items():
+        print(f"sugoi {'int8' if quantize else 'fp32'}: {len(corpus) * repeat / elapsed:.1f} sentences/s, " +
+              (f"peak RSS {rss:.0f} MiB" if rss else "peak RSS unknown"))
+    fp32, int8 = results[False][1], results[True][1]
+    same = sum(1 for a, b in zip(fp32, int8) if a == b)
+    similarity = sum(difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(fp32, int8)) / len(fp32)
+    print(f"sugoi int8 drift: {same}/{len(fp32)} identical, mean similarity {similarity:.3f}")
+
+
+def _sugoi_pool_run(workers, corpus, repeat):
+    from sugoitranslate import SugoiTranslate
+    with SugoiTranslate(by_line=True, workers=workers) as sugoi:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = sugoi.translate_lines_batched(corpus)
+        return time.perf_counter() - start, result, sugoi.workers, sugoi.threads
+
+
+@benchmark
+def bench_sugoi_pool(repeat=3):
+    """ Sugoi single model vs worker processes: sentences/s """
+    try:
+        import fairseq
+    except ImportError:
+        print("sugoi_pool: skipped, fairseq isn't installed")
+        return
+    corpus = SUGOI_CORPUS * 10
+    single_time, single, _, _ = _sugoi_pool_run(1, corpus, repeat)
+    pool_time, pooled, workers, threads = _sugoi_pool_run(0, corpus, repeat)
+    print(f"sugoi 1 process: {len(corpus) * repeat / single_time:.1f} sentences/s; " +
+          f"{workers} workers x {threads or 'default'} threads: {len(corpus) * repeat / pool_time:.1f} sentences/s" +
+          ('' if single == pooled else ", RESULTS DIFFER"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs filetranslate micro-benchmarks")
+    parser.add_argument("names", nargs='*', help=f"Benchmarks to run: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    for name in args.names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}")
+            continue
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
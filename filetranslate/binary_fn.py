@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+binary_fn
+~~~~~~~~~
+
+Patching of translated strings in binary files.
+
+`BinaryPatcher` collects same-size string patches of a file read into a
+`bytearray`: at known offsets or at the first free occurrence of the original
+bytes. All searched originals are found in one multi-pattern scan, patches are
+checked for overlaps in the order they were added (like the former sequential
+replaces) and written in one pass. Originals occurring more than once and
+patches that couldn't be placed are kept for the report.
+
+`extract_strings` finds zero-terminated strings for the translation database
+with their offsets; with pefile installed only the data sections of PE files
+(.exe, .dll) are scanned.
+"""
+__version__ = '0.2.0'
+
+import re, bisect
+from dictionary_fn import trie_pattern
+try:
+    import pefile
+except ImportError:
+    pefile = None
+
+REPORT_MAX_ITEMS = 20 # of each kind printed by BinaryPatcher.report
+MIN_STRING_BYTES = 5 # shorter strings are mostly random data
+MIN_WIDE_STRING_BYTES = 8 # same for UTF-16
+IMAGE_SCN_MEM_EXECUTE = 0x20000000
+VALID_STRING_RE = re.compile(r'[\u3041-\u3096\u30A0-\u30FF\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A\u2E80-\u2FD5\uFF5F-\uFF9F'
+                             r'\u3000-\u303F\u31F0-\u31FF\u3220-\u3243\u3280-\u337F\uFF01-\uFF5E\u2026-\u203B'
+                             r'a-zA-Z\d\s.,!?()\-\[\]@#$%^&*:;\'"_+=/\\|`~]+')
+
+
+def is_wide_encoding(encoding):
+    return 'utf-16' in encoding.lower().replace('_', '-')
+
+
+def string_sections(data) -> list:
+    """ Returns [(start, end)] file ranges to look for strings in: sections of a PE file
+        without code or the whole data if it isn't a PE file or pefile isn't installed
+    """
+    if pefile is None or data[:2] != b'MZ':
+        return [(0, len(data))]
+    try:
+        pe = pefile.PE(data=bytes(data), fast_load=True)
+    except pefile.PEFormatError:
+        return [(0, len(data))]
+    sections = [(section.PointerToRawData, section.PointerToRawData + section.SizeOfRawData)
+                for section in pe.sections
+                if section.SizeOfRawData and not section.Characteristics & IMAGE_SCN_MEM_EXECUTE]
+    pe.close()
+    return sections or [(0, len(data))]
+
+
+def extract_strings(data, encoding, start=0, end=None, min_length=None):
+    """ Yields (offset, string, length in bytes) of zero-terminated strings in the encoding """
+    step = 2 if is_wide_encoding(encoding) else 1
+    zero = b'\0' * step
+    if min_length is None:
+        min_length = MIN_WIDE_STRING_BYTES if step == 2 else MIN_STRING_BYTES
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        stop = data.find(zero, pos, end)
+        while stop != -1 and (stop - pos) % step: # UTF-16 characters are aligned
+            stop = data.find(zero, stop + 1, end)
+        if stop == -1:
+            break
+        if stop - pos >= min_length:
+            try:
+                string = data[pos:stop].decode(encoding)
+            except UnicodeDecodeError:
+                string = None
+            if string and VALID_STRING_RE.fullmatch(string):
+                yield pos, string, stop - pos
+        pos = stop + step
+
+
+def find_all(data, patterns) -> dict:
+    """ Returns {pattern: [start positions]} of all (also overlapping) occurrences of byte patterns """
+    patterns = sorted(set(filter(None, patterns)))
+    positions = {pattern: [] for pattern in patterns}
+    if not patterns:
+        return positions
+    # the lookahead finds the longest pattern at every position;
+    # patterns that are prefixes of others are searched separately
+    shadowed = [p for p, q in zip(patterns, patterns[1:]) if q.startswith(p)]
+    trie = trie_pattern([pattern.decode('latin-1') for pattern in patterns]).encode('latin-1')
+    for match in re.finditer(b'(?=(' + trie + b'))', data):
+        positions[match[1]].append(match.start())
+    for pattern in shadowed:
+        found = set(positions[pattern])
+        start = data.find(pattern)
+        while start != -1:
+            found.add(start)
+            start = data.find(pattern, start + 1)
+        positions[pattern] = sorted(found)
+    return positions
+
+
+class BinaryPatcher():
+    """ Same-size patches of binary data applied in place. """
+    def __init__(self, data):
+        self.data = data if isinstance(data, bytearray) else bytearray(data)
+        self._requests = []
+        self.patched = [] # (offset, label) of written patches
+        self.skipped = [] # (offset or None, label, reason)
+        self.ambiguous = [] # (offset, label, number of occurrences)
+
+    def add_at(self, offset, original, replacement, label=None):
+        """ Patches the original at the offset if it's still there """
+        assert len(original) == len(replacement)
+        self._requests.append((offset, original, replacement, label))
+
+    def add(self, original, replacement, label=None):
+        """ Patches the first occurrence of the original not taken by a previous patch """
+        assert len(original) == len(replacement)
+        self._requests.append((None, original, replacement, label))
+
+    def skip(self, offset, label, reason):
+        """ Records a patch rejected by the caller for the report """
+        self.skipped.append((offset, label, reason))
+
+    def apply(self) -> int:
+        """ Places the patches in order and writes them; returns the number of changed strings """
+        positions = find_all(self.data, (r[1] for r in self._requests if r[0] is None))
+        next_free = dict() # index of the first occurrence of an original that may be free
+        starts, ends = [], [] # taken regions sorted by start
+        patches = []
+
+        def is_free(start, end):
+            i = bisect.bisect_right(starts, start)
+            return (i == 0 or ends[i - 1] <= start) and (i == len(starts) or starts[i] >= end)
+
+        for offset, original, replacement, label in self._requests:
+            k = None
+            if offset is not None:
+                if self.data[offset:offset + len(original)] != original:
+                    self.skipped.append((offset, label, "original not at offset"))
+                    continue
+                if not is_free(offset, offset + len(original)):
+                    self.skipped.append((offset, label, "overlaps another patch"))
+                    continue
+            else:
+                found = positions.get(original, [])
+                if len(found) > 1 and original not in next_free:
+                    self.ambiguous.append((found[0], label, len(found)))
+                k = next_free.get(original, 0)
+                while k < len(found) and not is_free(found[k], found[k] + len(original)):
+                    k += 1
+                next_free[original] = k
+                if k == len(found):
+                    self.skipped.append((None, label, "not found" if not found else "all occurrences taken"))
+                    continue
+                offset = found[k]
+            if replacement == original:
+                continue # unchanged strings don't take the place like the former replaces
+            if k is not None:
+                next_free[original] = k + 1
+            i = bisect.bisect_right(starts, offset)
+            starts.insert(i, offset)
+            ends.insert(i, offset + len(original))
+            patches.append((offset, replacement, label))
+
+        for offset, replacement, label in sorted(patches, key=lambda patch: patch[0]):
+            self.data[offset:offset + len(replacement)] = replacement
+            self.patched.append((offset, label))
+        self._requests = []
+        return len(patches)
+
+    def report(self, max_items=REPORT_MAX_ITEMS) -> str:
+        """ Returns summary of the applied patches with skipped and ambiguous ones """
+        lines = [f"{len(self.patched)} strings patched, {len(self.skipped)} skipped, {len(self.ambiguous)} ambiguous"]
+        for offset, label, reason in self.skipped[:max_items]:
+            lines.append(f"  skipped{'' if offset is None else f' {offset:#x}'}: {label!r} ({reason})")
+        for offset, label, count in self.ambiguous[:max_items]:
+            lines.append(f"  ambiguous {offset:#x}: {label!r} (found {count} times, first free one patched)")
+        n_more = max(0, len(self.skipped) - max_items) + max(0, len(self.ambiguous) - max_items)
+        if n_more:
+            lines.append(f"  ... and {n_more} more")
+        return '\n'.join(lines)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+dictionary_fn
+~~~~~~~~~~~~~
+
+Precompiled ordered replacement dictionaries.
+
+`ReplacementDictionary` gives the same result as applying `re.sub(key, value, text)`
+for every entry in order, but it's built once: regexp keys are compiled and runs of
+consecutive literal keys are merged into one trie-shaped pattern replaced in a single
+pass. Literal entries are only merged when the single pass provably can't differ
+from the sequential one (no key overlaps another key or an earlier value of the run).
+With `literal=True` the entries are plain strings applied like `text.replace(key, value)`.
+`OutDictionary` wraps translation_dictionary_out.csv for all paths applying it.
+"""
+__version__ = '0.3.0'
+
+import re, functools
+
+REGEX_META_CHARS = frozenset(".^$*+?{}[]\\|()")
+
+
+def is_literal_entry(key, value):
+    """ Checks if re.sub(key, value, ...) is a plain string replacement """
+    return (bool(key) and not any(c in REGEX_META_CHARS for c in key) and
+            (not value or '\\' not in value))
+
+
+def trie_pattern(keys):
+    """ Makes a regexp matching any of the keys that branches on characters like a trie
+        (a plain alternation of thousands of strings tries every one at each position).
+    """
+    trie = dict()
+    for key in keys:
+        node = trie
+        for c in key:
+            node = node.setdefault(c, dict())
+        node[''] = None
+
+    def node_pattern(node):
+        # collapse single-child chains into literal runs to keep nesting shallow
+        run = ''
+        while len(node) == 1 and '' not in node:
+            (c, node), = node.items()
+            run += c
+        if run:
+            return re.escape(run) + node_pattern(node)
+        is_end = '' in node
+        branches = [re.escape(c) + node_pattern(child) for c, child in sorted(node.items()) if c]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if is_end:
+            body = '(?:' + body + ')?' # longer key wins like it would in a sorted alternation
+        return body
+
+    return node_pattern(trie)
+
+
+class _LiteralGroup():
+    """ Run of literal replacements that can be done in one pass """
+    def __init__(self):
+        self.table = dict()
+        self.members = set() # keys and values of the run
+        self.prefixes = set()
+        self.suffixes = set()
+        self.closed = False
+        self.regex = None
+
+    def _overlaps(self, key):
+        if key in self.members: return True
+        # a member is inside the key or the key is inside a member
+        n = len(key)
+        for i in range(n):
+            for j in range(i + 1, n + 1):
+                if key[i:j] in self.members: return True
+        if key in self.prefixes or key in self.suffixes:
+            return True # key is a prefix/suffix of a member
+        if any(key in s for s in self.members if len(s) > n):
+            return True
+        # key end continues with a member start or vice versa
+        for i in range(1, n):
+            if key[i:] in self.prefixes or key[:i] in self.suffixes:
+                return True
+        return False
+
+    def try_add(self, key, value):
+        if self.closed or self._overlaps(key):
+            return False
+        self.table[key] = value
+        for s in (key, value):
+            if not s: continue
+            self.members.add(s)
+            for i in range(1, len(s) + 1):
+                self.prefixes.add(s[:i])
+                self.suffixes.add(s[-i:])
+        if not value or not key:
+            self.closed = True # removal glues the neighbours so any later key could appear
+        return True
+
+    def compile(self):
+        keys = sorted(self.table, key=len, reverse=True)
+        self.regex = re.compile(trie_pattern(keys) if len(keys) > 1 else re.escape(keys[0]))
+
+    def make_sub(self):
+        """ Returns text -> text function doing the run """
+        if len(self.table) == 1:
+            ((key, value),) = self.table.items()
+            return lambda text: text.replace(key, value)
+        table = self.table
+        regex = self.regex
+        return lambda text: regex.sub(lambda m: table[m.group()], text) if regex.search(text) else text
+
+
+class ReplacementDictionary():
+    """ Ordered list of [key, value] replacements compiled once """
+    def __init__(self, entries, flags=re.U, literal=False):
+        self.steps = []
+        group = None
+        for entry in entries:
+            if len(entry) < 1: continue
+            key = entry[0]
+            value = '' if len(entry) < 2 or entry[1] is None else entry[1]
+            if literal or (is_literal_entry(key, value) and not (flags & re.I)):
+                if group is None or not group.try_add(key, value):
+                    group = _LiteralGroup()
+                    group.try_add(key, value)
+                    self.steps.append(group)
+            else:
+                group = None
+                self.steps.append((re.compile(key, flags), value))
+        self._subs = []
+        for step in self.steps:
+            if isinstance(step, _LiteralGroup):
+                step.compile()
+                self._subs.append(step.make_sub())
+            else:
+                self._subs.append(functools.partial(step[0].sub, step[1]))
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __bool__(self):
+        return len(self.steps) > 0
+
+    def sub(self, text):
+        """ Applies all replacements to the text in order """
+        for sub in self._subs:
+            text = sub(text)
+        return text
+
+
+class OutDictionary():
+    """ Entries of translation_dictionary_out.csv ([translation regexp, fixed text]) compiled once
+        for every way they are applied; each variant is built on first use.
+    """
+    def __init__(self, entries):
+        self.entries = [entry for entry in entries if len(entry) > 0]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return len(self.entries) > 0
+
+    @functools.cached_property
+    def _nonempty(self):
+        return ReplacementDictionary([entry for entry in self.entries if entry[0]])
+
+    @functools.cached_property
+    def _multiline(self):
+        return ReplacementDictionary([entry for entry in self.entries if entry[0]], re.U | re.M)
+
+    @functools.cached_property
+    def _all(self):
+        return ReplacementDictionary(self.entries)
+
+    def sub(self, text, multiline=False):
+        """ Applies the entries with non-empty regexps to a translation, with multiline
+            ^ and $ match at every line like in -fix
+        """
+        return (self._multiline if multiline else self._nonempty).sub(text)
+
+    def sub_all(self, text):
+        """ Applies all entries (an empty regexp matches everywhere) like to whole files """
+        return self._all.sub(text)
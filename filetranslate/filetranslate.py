@@ -8,12 +8,20 @@ from typing import Tuple, List
 # add curent file's directory to path to include modules from the same folder
 sys.path.append(os.path.dirname(__file__))
 
-import re, argparse, textwrap, hashlib, datetime
-import itertools, functools, fnmatch
+import re, argparse, textwrap, hashlib, datetime, asyncio
+import itertools, functools, fnmatch, threading, bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from shutil import move#, copyfile
-from time import sleep
 from PIL import Image, ImageFont
 from maxcolor import MaxColor
+from dictionary_fn import ReplacementDictionary, OutDictionary, trie_pattern
+from mtlbackend import EventLoopThread, load_backend, resolve_backend_name, format_backends, describe_backend
+from ratelimit import RateLimiter
+from translation_memory import TranslationMemory, TranslationStore, DEFAULT_MAX_SIZE as TM_MAX_SIZE
+from journal import TranslationJournal
+from indexed_row import IndexedRow
+from binary_fn import BinaryPatcher, extract_strings, string_sections
 from language_fn import *
 from service_fn import *
 from math import isnan
@@ -26,9 +34,10 @@ COMMENT_TAG = "//"
 DEFAULT_CUT_FONT = ("msgothic.ttc", 24)
 
 ENABLE_CACHE = True  # change this to manually set the state
-CACHE_EXPIRY_TIME = None #3*24*60*60
-TRANSLATION_BAN_DELAY = 60 * 60
-CACHE_MIN_TEXT_LENGTH = 2
+TRANSLATION_BAN_DELAY = 60 * 60 # maximal pause after repeated bans
+USE_TM = True # change this to manually set the state; persistent translation memory shared by projects
+ROWS_TM_NAMESPACE = "rows" # existing translations of whole database rows of a project (-warm)
+REUSED_ROWS_MAX_PRINT = 20 # row numbers listed when rows get existing translations
 
 USE_GIT = True # change this to manually set the state
 GIT_AUTHOR = None
@@ -43,11 +52,6 @@ if IS_WINDOWS: # Enable ANSI console escape codes without colorama
 import hashlib
 md5 = hashlib.md5
 
-from enum import IntEnum
-class TransNum(IntEnum):
-    googlet = 1
-    sugoi = 2
-
 try:
     if USE_GIT:
         import git
@@ -57,6 +61,9 @@ except:
     USE_GIT = False
 
 CACHE_DIR = "__pycache__"
+JOURNAL_DIR = os.path.join(CACHE_DIR, "journal") # checkpoints of partial translations
+PARSE_CACHE_VERSION = 2 # change when split_reader_to_array output changes
+PARSE_CACHE_EXPIRY_TIME = 30 * 24 * 60 * 60 # parses of edited databases are never read again
 cache = None
 try:
     from diskcache import Cache
@@ -64,6 +71,50 @@ try:
 except ImportError:
     ENABLE_CACHE = False
 
+
+class ParseCache():
+    """ Parsed databases (and the stages made from them) in the disk cache addressed by hash
+        of everything they are made from
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(file_hash, splitter, remove_newlines):
+        """ Key of a database parse: its content, replacement tags and the parse options """
+        return "parse:" + md5(f"{PARSE_CACHE_VERSION}|{file_hash}|{splitter.digest}|{remove_newlines}".encode(
+            'utf-8')).hexdigest()
+
+    @staticmethod
+    def stage_key(key, stage, *options):
+        """ Key of a later stage computed from a cached parse """
+        return f"{stage}:" + md5(repr((key, options)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if not ENABLE_CACHE or cache is None: return None
+        try:
+            value = cache.get(key)
+        except Exception: # unpicklable entry of another version
+            value = None
+        with self._lock:
+            if value is None: self.misses += 1
+            else: self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if ENABLE_CACHE and cache is not None:
+            cache.set(key, value, expire=PARSE_CACHE_EXPIRY_TIME)
+
+    def delete(self, key):
+        if cache is not None: cache.delete(key)
+
+    def report(self):
+        return f"Parse cache: {self.hits} hits, {self.misses} misses"
+
+parse_cache = ParseCache()
+
 from pkg_resources import get_distribution
 VERSION_STR = datetime.datetime.fromtimestamp(1600708851).strftime("%y.%m")
 if get_distribution(MODULE_NAME):
@@ -102,7 +153,6 @@ ATTRIBUTES_DB_POSTFIX = f"_{ATTRIBUTES_NAME}.csv"
 
 TEXT_RE_SPLITTER = '|<===>|'
 UNICODE_ESCAPE_RE = r'\\u[A-Fa-f\d]{4}'
-LOOKBEHIND_LINES = 10
 
 def get_primary_color(pa, x1, x2, y1, y2):
     pixels = []
@@ -132,59 +182,126 @@ def make_array_from_nth_item_and_previous(n, value=None, prev_array=[]):
     ret = [(prev_array[i] if (i < l_old and prev_array[i]) else item) for i, item in enumerate(ret)]
     return ret
 
-def separate_tags_and_sentence(sentence, tags=[], unescape=False, all_tags=r''):
-    starttag = ''
-    endtag = ''
-
-    # we search for up to # tags in any sequence at the string borders
-    # and move them to the array items
-    if not all_tags:
-        all_tags = '(?:(?:' + '|'.join(
-                re.escape(i[0]) for i in tags if not re.match(f'^[ \u3000]+$', i[0])
-            ) + ')[ \u3000]*)+'
-    for i in tags:
+SPACE_TAG_RE = re.compile('^[ \u3000]+$')
+
+def make_all_tags_re(tags, compact=False):
+    """ Pattern of a run of border tags (tags are strings, not regexps, so we escape them).
+        With compact=True the alternation is trie-shaped when no tag is a prefix of another one:
+        then only one tag can match at a position and the order of tags doesn't matter.
+    """
+    keys = [i[0] for i in tags if not SPACE_TAG_RE.match(i[0])]
+    ordered = sorted(keys)
+    if compact and all(ordered) and not any(b.startswith(a) for a, b in zip(ordered, ordered[1:])):
+        return '(?:(?:' + trie_pattern(keys) + ')[ \u3000]*)+'
+    return '(?:(?:' + '|'.join(re.escape(key) for key in keys) + ')[ \u3000]*)+'
+
+
+class TagSplitter():
+    """ Splits sentences into [starttag, sentence, endtag] with the tags of replacement_tags.csv;
+        same as separate_tags_and_sentence, but all patterns are compiled once for the database.
+    """
+    def __init__(self, tags=[], unescape=False, all_tags=r''):
+        if not all_tags:
+            all_tags = make_all_tags_re(tags, compact=True)
+        # alignment spaces are regexps of their own
+        self.space_tags = [(i[0], re.compile(f'^{i[0]}')) for i in tags if SPACE_TAG_RE.match(i[0])]
+        self.start_re = re.compile('^' + all_tags)
+        self.end_re = re.compile(all_tags + '$')
+        self.inner_tags = ReplacementDictionary([
+            [i[0], string_unescape(i[1]) if unescape else i[1]] for i in tags if not SPACE_TAG_RE.match(i[0])
+        ], literal=True)
+        # everything the result depends on, for the parse cache
+        self.digest = md5(repr((tags, unescape, all_tags, MAX_BORDER_TAGS, ENABLE_SFX_TO_ROMAJI)).encode(
+            'utf-8')).hexdigest()
+
+    def split(self, sentence):
+        starttag = ''
+        endtag = ''
         # parse alignment spaces if we have them no need to check them elsewhere
-        if re.match(r'^[ \u3000]+$', i[0]) and re.match(f'^{i[0]}', sentence):
-            starttag = i[0]
-            sentence = re.sub(f'^{i[0]}', '', sentence)
-
-    for _ in range(MAX_BORDER_TAGS):
-        # tags are strings, not regexps, so we escape them
-        starttag_r = re.compile('^' + all_tags).search(sentence)
-        if starttag_r:
-            starttag = starttag + starttag_r[0]
-            sentence = sentence.replace(starttag_r[0], '')
-            continue
+        for tag, tag_re in self.space_tags:
+            if tag_re.match(sentence):
+                starttag = tag
+                sentence = tag_re.sub('', sentence)
+
+        # we search for up to # tags in any sequence at the string borders
+        # and move them to the array items
+        for _ in range(MAX_BORDER_TAGS):
+            starttag_r = self.start_re.search(sentence)
+            if starttag_r:
+                starttag = starttag + starttag_r[0]
+                sentence = sentence.replace(starttag_r[0], '')
+                continue
 
-        endtag_r = re.compile(all_tags + '$').search(sentence)
-        if endtag_r:
-            endtag = endtag_r[0] + endtag
-            sentence = sentence.replace(endtag_r[0], '')
-            continue
+            endtag_r = self.end_re.search(sentence)
+            if endtag_r:
+                endtag = endtag_r[0] + endtag
+                sentence = sentence.replace(endtag_r[0], '')
+                continue
 
-    for i in tags:
-        if re.match(r'^[ \u3000]+$', i[0]): continue
-        if unescape:
-            sentence = sentence.replace(i[0], string_unescape(i[1]))
-        else:
-            sentence = sentence.replace(i[0], i[1])
+        sentence = self.inner_tags.sub(sentence)
 
-    if starttag == '': starttag = None
-    if endtag == '': endtag = None
+        if starttag == '': starttag = None
+        if endtag == '': endtag = None
 
-    if ENABLE_SFX_TO_ROMAJI and is_sfx(sentence):
-        sentence = re.compile("[ゅっ]").sub('h', sentence).replace('……', '… ')
-        #sentence = make_romaji(sentence)
+        if ENABLE_SFX_TO_ROMAJI and is_sfx(sentence):
+            sentence = re.compile("[ゅっ]").sub('h', sentence).replace('……', '… ')
+            #sentence = make_romaji(sentence)
 
-    return [starttag, sentence, endtag]
+        return [starttag, sentence, endtag]
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_tag_splitter(file_name, mtime, size):
+    return TagSplitter(read_csv_list(file_name))
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_tag_unreplacer(file_name, mtime, size, lang):
+    return TagUnreplacer(read_csv_list(file_name), lang)
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_out_dictionary(file_name, mtime, size):
+    return OutDictionary(read_csv_list(file_name))
+
+
+def _file_version(file_name):
+    """ Returns (absolute path, modification time, size) of a file or None if it doesn't exist """
+    try:
+        st = os.stat(file_name)
+    except OSError:
+        return None
+    return os.path.abspath(file_name), st.st_mtime_ns, st.st_size
+
+
+def get_tag_splitter(file_name):
+    """ TagSplitter of a replacement_tags.csv shared by all databases until the file changes """
+    version = _file_version(file_name)
+    return _cached_tag_splitter(*version) if version else TagSplitter()
+
+
+def get_tag_unreplacer(file_name, lang='JA'):
+    """ TagUnreplacer of a replacement_tags.csv shared by all databases until the file changes """
+    version = _file_version(file_name)
+    return _cached_tag_unreplacer(*version, lang) if version else TagUnreplacer([], lang)
+
+
+def get_out_dictionary(file_name):
+    """ OutDictionary of a translation_dictionary_out.csv shared by all files until it changes """
+    version = _file_version(file_name)
+    return _cached_out_dictionary(*version) if version else OutDictionary([])
+
+
+def separate_tags_and_sentence(sentence, tags=[], unescape=False, all_tags=r''):
+    """ Single sentence version of TagSplitter; use the class to split many sentences """
+    return TagSplitter(tags, unescape, all_tags).split(sentence)
 
 
 def split_reader_to_array(reader_array, tags=[], remove_newlines=False):
+    """ Makes indexed array (list of IndexedRow) of a database; tags are list of replacement tags or a TagSplitter """
     indexed_array = []
     i = 0
-    all_tags_re = '(?:(?:' + '|'.join(
-            re.escape(i[0]) for i in tags if not re.match(f'^[ \u3000]+$', i[0])
-        ) + ')[ \u3000]*)+'
+    splitter = tags if isinstance(tags, TagSplitter) else TagSplitter(tags)
     print_progress(0, 100)
     pos = 0
     old_pos = 0
@@ -199,10 +316,10 @@ def split_reader_to_array(reader_array, tags=[], remove_newlines=False):
         arr = tmp.splitlines()
         l = len(arr) # for easier debugging
         for j, a in enumerate(arr):
-            arr[j] = separate_tags_and_sentence(a, tags, all_tags=all_tags_re)
+            arr[j] = splitter.split(a)
 
-        indexed_array.append([i, l, line[0], arr] + line[1:])
-        # indexed_array addressing format is thus
+        indexed_array.append(IndexedRow.from_lines(i, line[0], arr, line[1:]))
+        # indexed_array addressing format is thus (IndexedRow keeps it for indexing)
         # [item_n][0=index, 1=length, 2=orignial_line, 3=str_arr, 4=translation]([1=string, 0=stag, 2=etag] if str_arr)
         i += 1
         pos = int(i/len(reader_array)*100)
@@ -213,20 +330,18 @@ def split_reader_to_array(reader_array, tags=[], remove_newlines=False):
 
 
 def string_from_indexed_array_item(indexed_array_item, to_original=False):
-    if to_original:
-        if len(indexed_array_item[3]) == 1:
-            return ''.join(filter(None, indexed_array_item[3][0]))
-        ending = '' # if we capture full lines the last line should be \n terminated too
-        if indexed_array_item[2] and indexed_array_item[2][-1:] == '\n':
-            #print(indexed_array_item[2][-1:])
-            ending = '\n'
-        return '\n'.join(''.join(filter(None, i)) for i in indexed_array_item[3]) + ending
-    return '\n'.join(i[1].strip() for i in indexed_array_item[3] if i[1] is not None)
+    if not isinstance(indexed_array_item, IndexedRow):
+        indexed_array_item = IndexedRow.from_list(indexed_array_item)
+    return indexed_array_item.text(to_original)
 
 
 def revert_text_to_indexed_array(translations_arr, indexed_array, **kwargs):
     """Moves translated text to indexed_array's items' [3][k][1] (main text element of each string) with overwrite.
+       Rows in the old list layout are returned as new lists.
     """
+    is_list = bool(indexed_array) and not isinstance(indexed_array[0], IndexedRow)
+    if is_list:
+        indexed_array = [IndexedRow.from_list(row) for row in indexed_array]
     original_indexes = kwargs.get("original_indexes", [])
     preformat_str = kwargs.get("preformat_str", [])
     preformat_re = None
@@ -237,11 +352,11 @@ def revert_text_to_indexed_array(translations_arr, indexed_array, **kwargs):
     translations_l = len(translations_arr)
 
     is_partial = (partial_l > 0)
-    original_l = sum(i[1] for i in indexed_array if (not is_partial or (i[0] in original_indexes)))
+    original_l = sum(row.n_lines for row in indexed_array if (not is_partial or (row.index in original_indexes)))
 
     if translations_l != original_l:
-        write_csv_list('error.csv', [[indexed_array[i][2] if i < original_l else '',
-            indexed_array[i][2] if i < original_l else '',
+        write_csv_list('error.csv', [[indexed_array[i].original if i < original_l else '',
+            indexed_array[i].original if i < original_l else '',
             translations_arr[i] if i < translations_l else ''] for i in range(max(translations_l, original_l))])
         raise Exception(f"ERROR: number of translations ({translations_l}) doesn't match originals ({original_l})!\n" +
             "Check if MTL returned proper number of lines and original .csv is valid\n" +
@@ -249,31 +364,93 @@ def revert_text_to_indexed_array(translations_arr, indexed_array, **kwargs):
 
     i = 0
     for row in indexed_array:
-        j = row[0]
+        j = row.index
         if is_partial and j not in original_indexes: continue
-        lines_originally = row[1]
+        lines_originally = row.n_lines
+        texts = list(indexed_array[j].texts)
         tmp = translations_arr[i:i+lines_originally]
         skip = False
         for k in range(lines_originally):
-            if indexed_array[j][3][k][1] is None or len(indexed_array[j][3][k][1]) == 0: continue
+            if texts[k] is None or len(texts[k]) == 0: continue
             cur_tmp: str = tmp[k].strip()
             if preformat_str:
                 preformatted = preformat_re.split(cur_tmp)
                 if len(preformatted) > 2:
                     cur_tmp = ''.join(preformatted[2:])
             if len(cur_tmp) > 0:
-                indexed_array[j][3][k][1] = cur_tmp
+                texts[k] = cur_tmp
             elif lines_originally == 1:
                 skip = True # skip indexed_array one-liners with falied translaions for future retry
                 break
 
         i += lines_originally
+        indexed_array[j].texts = tuple(texts)
         try:
-            indexed_array[j][4] = '' if skip else string_from_indexed_array_item(indexed_array[j], True)
+            indexed_array[j][4] = '' if skip else indexed_array[j].text(True)
         except:
             print("Error in indexed item", indexed_array[j])
 
-    return indexed_array
+    return [row.to_list() for row in indexed_array] if is_list else indexed_array
+
+
+def make_merge_flags(indexed_array, rows_text, mergeque, type_str=True, upgrade=False):
+    """ Decides which lines of the rows to translate can be merged with the next line by MTL.
+
+        rows_text: [(row index, text sent to MTL), ...]
+        mergeque: "ender||nostarter||noendtag" regexps (see -mque)
+        Returns {row index: [merge flag of each line]} for the batcher.
+    """
+    r = mergeque.split('||')
+    # generic specification if the line allowed to be merged; for example [^;…。？！）\.\]]*$
+    merge_ender_re = re.compile(r'%s' % r[0]) if len(r)>0 else None
+    # stuff that's blocking for merging in start tags of the current/next line; for example (?:^[（「\\])
+    merge_nostarter_re = re.compile(r'%s' % r[1]) if len(r)>1 else None
+    # stuff that's blocking for merging in end tags of the current/previous line; for example (?:[」）]$)
+    merge_noendtag_re = re.compile(r'%s' % r[2]) if len(r)>2 else None
+    n_rows = len(indexed_array)
+    intros = dict() # row index => nostarter found in each line's start tag or text
+
+    def check_blocking_intro(idx, in_idx):
+        # not last item of indexed_array or indexed_array's item pre-processed split
+        if idx >= n_rows: return True
+        if in_idx >= indexed_array[idx].n_lines: return False
+        if upgrade and (idx + 1 < n_rows and indexed_array[idx + 1].translation): return True
+        if idx not in intros:
+            row = indexed_array[idx]
+            # check if nostarter is in starttags or in item's translatable text (0 and 1 array items)
+            intros[idx] = [bool(stag and merge_nostarter_re.search(stag)) or bool(text and merge_nostarter_re.search(text))
+                           for stag, text, _ in map(row.line, range(row.n_lines))]
+        return intros[idx][in_idx]
+
+    flags = dict()
+    for i, repl_line in rows_text:
+        row = indexed_array[i]
+        allow_merge = (True if type_str else bool('\n' in repl_line)) #and not upgrade
+        mergeable_lines = row.n_lines
+        is_mergeable = [None] * mergeable_lines
+        for i_ln in range(mergeable_lines):
+            stag, text, etag = row.line(i_ln)
+            # check if nostarter is in next pre-translation split or in next line of csv
+            if merge_nostarter_re and (check_blocking_intro(i, i_ln+1) or check_blocking_intro(i+1, 0)):
+                is_mergeable[i_ln] = False
+                continue
+
+            # check endtag(s) for allowed enders too
+            if merge_noendtag_re and etag and merge_noendtag_re.search(etag):
+                is_mergeable[i_ln] = False
+                if not type_str: # found blocking endtag in attribute: stop merging everything after
+                    allow_merge = False
+                continue
+
+            # check text for allowed ender, if it's long enough and allowed to merge
+            is_mergeable[i_ln] = bool(text and merge_ender_re.search(text)) and len(text) > 4 and allow_merge
+            if mergeable_lines > 1 and i_ln < mergeable_lines - 1 and not row.texts[i_ln+1]:
+                is_mergeable[i_ln] = False # empty next line marks end of the sentence
+            if not type_str:
+                if i_ln >= mergeable_lines - 1:
+                    is_mergeable[i_ln] = False # last line of a multiline attribute block
+        flags[i] = is_mergeable
+    return flags
 
 
 def write_svg(image, boxes, texts):
@@ -314,6 +491,38 @@ def write_svg(image, boxes, texts):
 
     return False
 
+def _getTextToTranslate(self, row, context=''):
+    """ Returns text of an indexed array item as it's sent to MTL and the current context.
+    """
+    repl_line = row.text()
+    if row.original[:2] == COMMENT_TAG:
+        repl_line = repl_line[2:]
+        #continue
+
+    if self.preformat and len(row) > 5:
+        row_context = row.context
+        if (row_context or row_context == '') and context != row_context:
+            context = row_context
+        if context.strip():
+            repl_line = self.preformat % (context, repl_line) # NOTE: preformat str must contain 2x %s
+    return repl_line, context
+
+def _getJournal(self, trn_svc, file_name, file_hash, type_str, upgrade):
+    """ Returns journal of translateCSV for the database and translation options """
+    return TranslationJournal(JOURNAL_DIR, file_name, {
+        "hash": file_hash, "upgrade": upgrade, "type_str": type_str, "backend": trn_svc.backend.name,
+        "langs": f"{trn_svc.lang_src}-{trn_svc.lang_dest}", "merge": trn_svc.do_merge,
+        "preformat": self.preformat, "mergeque": self.re_mergeque
+    })
+
+def get_reused_rows(row_memory, reader_ind):
+    """ Returns {row index: translation} of untranslated rows found in the row memory (-warm) """
+    if row_memory is None:
+        return dict()
+    untranslated = [row.index for row in reader_ind if row.original and not row.translation]
+    found = row_memory.get_many([reader_ind[i].original for i in untranslated])
+    return {i: tl for i, tl in zip(untranslated, found) if tl}
+
 # skips files with no translatable strings found and already translated files
 def translateCSV(self, trn_svc, file_name, type_str=True, upgrade=False):
     """ Translates or upgrades translations in database file with game texts.
@@ -324,9 +533,10 @@ def translateCSV(self, trn_svc, file_name, type_str=True, upgrade=False):
     num_tled_lines = 0
     num_tled_lines_new = 0
     untranslated_lines = []
-    global cache
 
     # Basic csv file integrity and translation status verification
+    with open(file_name, 'rb') as f:
+        file_hash = md5(f.read()).hexdigest()
     with open(file_name, 'r', newline='', encoding=CSV_ENCODING) as f:
         for i, line in enumerate(csv.reader(f, DIALECT_TRANSLATION)):
             if len(line) == 0:
@@ -341,20 +551,24 @@ def translateCSV(self, trn_svc, file_name, type_str=True, upgrade=False):
         return 0
 
     max_chars = trn_svc.get_char_limit()
-    string_tags = read_csv_list(os.path.join(self.work_dir, REPLACEMENT_TAG_DB))
-    upgraded_lines = []
+    string_tags = get_tag_splitter(os.path.join(self.work_dir, REPLACEMENT_TAG_DB))
+
+    # batches translated before a crash or a ban are taken from the journal
+    journal = self.getJournal(trn_svc, file_name, file_hash, type_str, upgrade)
+    translated_rows = journal.load() # row index => translated lines
+    if translated_rows:
+        print(f"Resuming {os.path.basename(file_name)} from journal: {len(translated_rows)} rows done")
+    journal.open(translated_rows)
 
-    with open(file_name, mode="r", encoding=CSV_ENCODING) as f:
-        reader_ind = None
+    with journal, open(file_name, mode="r", encoding=CSV_ENCODING) as f:
         print_progress(0, 100)
-        if ENABLE_CACHE and cache:
-            if not upgrade:
-                reader_ind = cache.get(file_name)
+        # the key changes with the database, tags or options so a stale parse can't be read
+        cache_key = parse_cache.key(file_hash, string_tags, self.remove_newlines)
+        reader_ind = parse_cache.get(cache_key)
         if reader_ind is None:
             reader_ind = split_reader_to_array(
                 list(csv.reader(f, DIALECT_TRANSLATION)), string_tags, self.remove_newlines)
-            if ENABLE_CACHE:
-                cache.set(file_name, reader_ind, expire=CACHE_EXPIRY_TIME)
+            parse_cache.set(cache_key, reader_ind)
 
         num_lines = len(reader_ind)
         try:
@@ -363,128 +577,88 @@ def translateCSV(self, trn_svc, file_name, type_str=True, upgrade=False):
                     len(row) > 4 and row[4] is None or len(row[4]) == 0)
                 )
         except IndexError as e:
-            del cache[file_name]
+            parse_cache.delete(cache_key)
             l = [row for row in reader_ind if len(row) < 5]
             f = os.path.basename(file_name)
             raise Exception(f"Error on lines: {l} of {f}")
 
         num_tled_lines = len(reader_ind) - num_lines
+
+        # whole rows translated before in this or other databases (see importTranslations)
+        reused_rows = get_reused_rows(trn_svc.row_memory, reader_ind)
+        if reused_rows:
+            reused = sorted(reused_rows)
+            print(f"\rReused existing translations of {len(reused)} rows in {os.path.basename(file_name)}: " +
+                  ', '.join(map(str, reused[:REUSED_ROWS_MAX_PRINT])) +
+                  (" ..." if len(reused) > REUSED_ROWS_MAX_PRINT else ''))
         progress_divisor = max(1, num_lines // 1000)
         to_transl = []
+        batch_rows = []
         merging_que_arr = []
-        translated = []
+        row_order = []
         last_size = 0
         changed_lines = 0
         ttype = 0
-        merge_ender_re = merge_nostarter_re = merge_noendtag_re = None
         context = ''
 
         print_progress(1, 100, type_of_progress=4)
-        if self.re_mergeque:
-            r = self.re_mergeque.split('||')
-            # generic specification if the line allowed to be merged; for example [^;…。？！）\.\]]*$
-            merge_ender_re = re.compile(r'%s' % r[0]) if len(r)>0 else None
-            # stuff that's blocking for merging in start tags of the current/next line; for example (?:^[（「\\])
-            merge_nostarter_re = re.compile(r'%s' % r[1]) if len(r)>1 else None
-            # stuff that's blocking for merging in end tags of the current/previous line; for example (?:[」）]$)
-            merge_noendtag_re = re.compile(r'%s' % r[2]) if len(r)>2 else None
+
+        def translate_batch():
+            """ Translates current batch, splits it to rows and journals them """
+            ttype, _text = trn_svc.translate(to_transl, type_str and not upgrade, merging_que_arr)
+            record = dict()
+            pos = 0
+            for j in batch_rows:
+                record[j] = _text[pos:pos + reader_ind[j].n_lines]
+                pos += reader_ind[j].n_lines
+            if pos != len(_text):
+                raise Exception(f"ERROR: number of translations ({len(_text)}) doesn't match originals ({pos}) " +
+                    f"in rows {batch_rows[0]}-{batch_rows[-1]} of {file_name}")
+            translated_rows.update(record)
+            journal.append(record)
+            return ttype
+
+        rows_text = [] # rows to translate with their text as it's sent to MTL
         for row in reader_ind:
-            if len(row[2]) == 0:
+            if len(row.original) == 0:
                 continue #or
                 raise Exception("ERROR: no source text for item", changed_lines)
-            if upgrade and row[4] is not None and len(row[4]) > 0: continue #have translation
-
-            i = row[0]
-            repl_line = string_from_indexed_array_item(reader_ind[i])
-            if reader_ind[i][2][:2] == COMMENT_TAG:
-                repl_line = repl_line[2:]
-                #continue
-            if upgrade:
-                upgraded_lines.append(i)
-
-            if self.preformat and len(reader_ind[i]) > 5:
-                if (reader_ind[i][5] or reader_ind[i][5] == '') and context != reader_ind[i][5]:
-                    context = reader_ind[i][5]
-                if context.strip():
-                    repl_line = self.preformat % (context, repl_line) # NOTE: preformat str must contain 2x %s
+            if upgrade and row.translation: continue #have translation
+            repl_line, context = self.getTextToTranslate(row, context)
+            rows_text.append((row.index, repl_line))
+
+        # merge flags of all lines are decided before batching
+        merge_flags = dict()
+        if self.re_mergeque: #and type_str: # TODO: what about attributes?
+            flags_key = parse_cache.stage_key(cache_key, "merge", self.re_mergeque, type_str, upgrade, self.preformat)
+            merge_flags = parse_cache.get(flags_key)
+            if merge_flags is None:
+                merge_flags = make_merge_flags(reader_ind, rows_text, self.re_mergeque, type_str, upgrade)
+                parse_cache.set(flags_key, merge_flags)
+
+        for i, repl_line in rows_text:
+            if i in reused_rows and i not in translated_rows:
+                reader_ind[i][4] = reused_rows[i]
+                changed_lines += 1
+                continue
+            row_order.append(i)
+            if i in translated_rows:
+                changed_lines += 1
+                continue
 
             # NOTE: Additional replacements should be done in a translation service class
             # or with translation_in. Batch translation in parts below max_chars:
             repl_line_len = len(repl_line)
-            is_last = (changed_lines >= (num_lines - 1))
-            # is_over_limit => new size + last size + linebreaks
-            is_over_limit = last_size + repl_line_len + len(to_transl) * 1 >= max_chars
-
-            is_mergeable = []
-            allow_merge = (True if type_str else bool('\n' in repl_line)) #and not upgrade
-            mergeable_lines = len(reader_ind[i][3])
-            if self.re_mergeque: #and type_str: # TODO: what about attributes?
-                is_mergeable = [None] * mergeable_lines
-                #print(self.re_mergeque)
-                for i_ln in range(mergeable_lines):
-                    item = reader_ind[i][3][i_ln]
-                    # check starttags and text start
-                    if merge_nostarter_re:
-                        def check_blocking_intro(idx, in_idx):
-                            # not last item of reader_ind or reader_ind's item pre-processed split
-                            if idx >= len(reader_ind): return True
-                            if in_idx >= len(reader_ind[idx][3]): return False
-                            if upgrade and (idx + 1 < len(reader_ind) and reader_ind[idx + 1][4]): return True
-
-                            check_item = reader_ind[idx][3][in_idx]
-                            # check if nostarter is in starttags or in item's translatable text (0 and 1 array items)
-                            is_in_tag = bool(check_item[0] is not None and len(check_item[0]) >= 1 and (
-                                merge_nostarter_re.search(check_item[0])))
-                            is_in_text = bool(check_item[1] and merge_nostarter_re.search(check_item[1]))
-                            return (is_in_tag or is_in_text)
-
-                        # check if nostarter is in next pre-translation split or in next line of csv
-                        if check_blocking_intro(i, i_ln+1) or check_blocking_intro(i+1, 0):
-                            is_mergeable[i_ln] = False
-                            continue
-
-                    # check endtag(s) for allowed enders too
-                    if (merge_noendtag_re):
-                        if item[2] is not None and len(item[2]) >= 1 and bool(merge_noendtag_re.search(item[2])):
-                            is_mergeable[i_ln] = False
-                            if not type_str: # found blocking endtag in attribute: stop merging everything after
-                                allow_merge = False
-                            continue
-
-                    # check text for allowed ender, if it's long enough and allowed to merge
-                    is_mergeable[i_ln] = bool(
-                            item[1] and merge_ender_re.search(item[1])
-                        ) and len(item[1]) > 4 and allow_merge
-                    if mergeable_lines > 1 and i_ln < len(reader_ind[i][3]) - 1 and not reader_ind[i][3][i_ln+1][1]:
-                        is_mergeable[i_ln] = False # empty next line marks end of the sentence
-                    if not type_str:
-                        if i_ln >= mergeable_lines - 1:
-                            is_mergeable[i_ln] = False # last line of a multiline attribute block
-
-            if is_over_limit or is_last:
-                if is_last:
-                    if is_over_limit:
-                        ttype, _text = trn_svc.translate(to_transl, type_str and not upgrade, merging_que_arr)
-                        translated += _text
-                        to_transl = [repl_line]
-                        if self.re_mergeque:
-                            merging_que_arr = is_mergeable
-                    else:
-                        to_transl.append(repl_line)
-                        if self.re_mergeque:
-                            merging_que_arr += is_mergeable
-                        last_size += repl_line_len
-                ttype, _text =  trn_svc.translate(to_transl, type_str and not upgrade, merging_que_arr)
-                translated += _text
-                to_transl = [repl_line]
-                if self.re_mergeque:
-                    merging_que_arr = is_mergeable
-                last_size = repl_line_len
-            else:
-                to_transl.append(repl_line)
-                if self.re_mergeque:
-                    merging_que_arr += is_mergeable
-                last_size += repl_line_len
+
+            # new size + last size + linebreaks over the limit => translate the batch first
+            if to_transl and last_size + repl_line_len + len(to_transl) >= max_chars:
+                ttype = translate_batch()
+                to_transl, batch_rows, merging_que_arr, last_size = [], [], [], 0
+            to_transl.append(repl_line)
+            batch_rows.append(i)
+            if self.re_mergeque:
+                merging_que_arr += merge_flags[i]
+            last_size += repl_line_len
 
             changed_lines += 1
             if changed_lines % progress_divisor == 0:
@@ -495,33 +669,149 @@ def translateCSV(self, trn_svc, file_name, type_str=True, upgrade=False):
                     start_from=2,
                     end_with=98
                 )
+        if to_transl:
+            ttype = translate_batch()
 
     # NOTE: translation should be checked for proper line count in the MT class or its override
-    if not len(translated):
+    translated = [line for i in row_order for line in translated_rows[i]]
+    if not len(translated) and not reused_rows:
+        journal.remove()
         print_progress(100, 100)
         return 0
 
-    reader_ind = revert_text_to_indexed_array(
-        translated, reader_ind, original_indexes=upgraded_lines, preformat_str=self.preformat)
+    if translated:
+        # only the rows sent to MTL get their translations from it
+        reader_ind = revert_text_to_indexed_array(translated, reader_ind,
+            original_indexes=(set(row_order) if upgrade or reused_rows else []), preformat_str=self.preformat)
     num_tled_lines_new = len(reader_ind)
     try:
-        num_tled_lines_new = sum(1 for row in reader_ind if (
-            len(row) > 4 and row[4] is not None and len(row[4]) > 0)
-        )
+        num_tled_lines_new = sum(1 for row in reader_ind if row.translation)
     except:
         pass
 
     with open(file_name, 'w', newline='', encoding=CSV_ENCODING) as f:
         writer = csv.writer(f, DIALECT_TRANSLATION)
         for row in reader_ind:
-            i = row[0]
-            out = reader_ind[i][4]
-            writer.writerow([reader_ind[i][2], out] + reader_ind[i][5:])
+            i = row.index
+            writer.writerow([reader_ind[i].original] + reader_ind[i].columns)
+    journal.remove()
 
     print_progress(100, 100)
 
     return num_tled_lines_new - num_tled_lines if num_tled_lines_new > num_tled_lines else num_tled_lines_new
 
+def _translateDuplicates(self, trn_svc, csv_files, upgrade=False):
+    """ Translates segments repeated across translation databases once before per-file translation.
+
+        Segments are made the same way as in translateCSV (batches, merging of partial lines, rows
+        taken from the row memory or a journal are skipped) so only the segments it would send are counted. Results are kept in the translation memory
+        and reach every file and row from there; the characters of their copies found there later
+        are counted in trn_svc.shared_hit_chars.
+        Returns number of the unique repeated segments and MTL characters sent for them.
+    """
+    if trn_svc.memory is None:
+        return 0, 0
+    string_tags = get_tag_splitter(os.path.join(self.work_dir, REPLACEMENT_TAG_DB))
+    max_chars = trn_svc.get_char_limit()
+    counts = dict() # memory key => [segment, number of occurrences]
+
+    def count_segments(lines, merging_que_arr, type_str):
+        _, _, segments = trn_svc.prepare_segments(lines, type_str and not upgrade, merging_que_arr)
+        for segment in segments:
+            key = trn_svc.memory.normalize(segment)
+            counts.setdefault(key, [segment, 0])[1] += 1
+
+    for file_name in csv_files:
+        if not os.path.isfile(file_name): continue
+        type_str = file_name.endswith(STRINGS_DB_POSTFIX)
+        with open(file_name, 'rb') as f:
+            file_hash = md5(f.read()).hexdigest()
+        with open(file_name, mode="r", encoding=CSV_ENCODING) as f:
+            rows = list(csv.reader(f, DIALECT_TRANSLATION))
+        if not rows: continue
+        untranslated = [len(row) < 2 or not row[1] for row in rows]
+        # same rules as in translateCSV
+        if not upgrade and not all(untranslated): continue
+        if upgrade and not any(untranslated): continue
+        cache_key = parse_cache.key(file_hash, string_tags, self.remove_newlines)
+        reader_ind = parse_cache.get(cache_key)
+        if reader_ind is None:
+            reader_ind = split_reader_to_array(rows, string_tags, self.remove_newlines)
+            parse_cache.set(cache_key, reader_ind)
+
+        context = ''
+        rows_text = []
+        for row in reader_ind:
+            if len(row.original) == 0: continue
+            if upgrade and row.translation: continue
+            repl_line, context = self.getTextToTranslate(row, context)
+            rows_text.append((row.index, repl_line))
+        merge_flags = dict()
+        if self.re_mergeque:
+            flags_key = parse_cache.stage_key(cache_key, "merge", self.re_mergeque, type_str, upgrade, self.preformat)
+            merge_flags = parse_cache.get(flags_key)
+            if merge_flags is None:
+                merge_flags = make_merge_flags(reader_ind, rows_text, self.re_mergeque, type_str, upgrade)
+                parse_cache.set(flags_key, merge_flags)
+
+        # rows filled from the row memory or the journal aren't sent by translateCSV
+        skipped_rows = get_reused_rows(trn_svc.row_memory, reader_ind).keys() | (
+            self.getJournal(trn_svc, file_name, file_hash, type_str, upgrade).load().keys())
+
+        # same batches as in translateCSV since lines are merged only inside a batch
+        to_transl, merging_que_arr, last_size = [], [], 0
+        for i, repl_line in rows_text:
+            if i in skipped_rows: continue
+            if to_transl and last_size + len(repl_line) + len(to_transl) >= max_chars:
+                count_segments(to_transl, merging_que_arr, type_str)
+                to_transl, merging_que_arr, last_size = [], [], 0
+            to_transl.append(repl_line)
+            if self.re_mergeque:
+                merging_que_arr += merge_flags[i]
+            last_size += len(repl_line)
+        if to_transl:
+            count_segments(to_transl, merging_que_arr, type_str)
+
+    repeated = [segment for segment, n in counts.values() if n > 1]
+    if not repeated:
+        return 0, 0
+
+    batch = []
+    batch_size = 0
+    for n, segment in enumerate(repeated):
+        if batch and batch_size + len(segment) + len(batch) >= max_chars:
+            trn_svc.translate_segments(batch, share=True)
+            batch = []
+            batch_size = 0
+        batch.append(segment)
+        batch_size += len(segment)
+        print_progress(n, len(repeated), end_with=99)
+    if batch:
+        trn_svc.translate_segments(batch, share=True)
+    print_progress(100, 100)
+
+    return len(repeated), trn_svc.shared_sent_chars
+
+def _importTranslations(self, row_memory):
+    """ Loads existing source => translation rows of all databases and their -u backups to the memory.
+
+        Returns number of the rows loaded.
+    """
+    file_names = []
+    for postfixes in ([f"*_{STRINGS_NAME}.old", f"*_{ATTRIBUTES_NAME}.old"], # current databases take priority
+                      ["*" + STRINGS_DB_POSTFIX, "*" + ATTRIBUTES_DB_POSTFIX]):
+        file_names += sorted(find_files(self.work_dir, postfixes))
+    translations = dict()
+    for n, file_name in enumerate(file_names):
+        with open(file_name, mode="r", encoding=CSV_ENCODING) as f:
+            for row in csv.reader(f, DIALECT_TRANSLATION):
+                if len(row) > 1 and row[0] and row[1]:
+                    translations[row[0]] = row[1]
+        print_progress(n, len(file_names), end_with=99)
+    row_memory.set_many(list(translations), list(translations.values()))
+    print_progress(100, 100)
+    return len(translations)
+
 def process_image(ocr_svc, file_name, invert=False, binarize=False, alphacolor=(0,0,0), make_svg=0, min_dist=(10,10), name_duplicate=False):
     """ Creates OCR texts database file from a game image.
     """
@@ -741,9 +1031,12 @@ def _makeComparisonTranslation(self, file_name_base, file_name_translated, name_
     return ret
 
 
-def _makeTranslatableStrings(self, file_name, upgrade=False, lang="JA", name_duplicate=False) -> int:
+def _makeTranslatableStrings(self, file_name, upgrade=False, lang="JA", name_duplicate=False, is_binary=False) -> int:
     """ Creates or upgrades translation database from a game file
     """
+    if is_binary:
+        return self.makeBinaryStrings(file_name, upgrade, lang, name_duplicate)
+
     j = 0
     # don't duplicate attribute strings
     onlyName = os.path.splitext(file_name)
@@ -1198,21 +1491,19 @@ def _applyFixesToTranslation(self, transl_fn, is_string=True, source_lang='JA'):
 
     print_progress(0, 100)
 
-    string_tags_list = read_csv_list(os.path.join(self.work_dir, REPLACEMENT_TAG_DB))
-    tr_dict_out = read_csv_list(os.path.join(self.work_dir, TRANSLATION_OUT_DB)) if is_string else []
+    tag_unreplacer = get_tag_unreplacer(os.path.join(self.work_dir, REPLACEMENT_TAG_DB), source_lang)
+    out_dict = get_out_dictionary(os.path.join(self.work_dir, TRANSLATION_OUT_DB)) if is_string else OutDictionary([])
 
     for i, row in enumerate(old_list):
         fixed = ''
         if len(row)>1 and row[1] is not None:
             fixed = row[1]
-            fixed = unreplace_tags(fixed, string_tags_list, lang=source_lang)
+            fixed = tag_unreplacer.sub(fixed)
 
             # Apply fixes from translation_dictionary_out [eng] -> [eng fixed]
             #    We do it here, not right after translation, to  backup unfixed copy and
             #    see what machine-translator will do to tags in original strings
-            for dict_line in tr_dict_out:
-                if len(dict_line[0]) > 0:
-                    fixed = re.sub(r'%s' % dict_line[0], r'%s' % dict_line[1], fixed, flags=re.M)
+            fixed = out_dict.sub(fixed, multiline=True)
 
             if not is_fixed and fixed != row[1]: is_fixed = True
             if i % progress_divisor == 0:
@@ -1254,6 +1545,98 @@ def sort_by_first_column_length(arr):
     sorted_arr = sorted(arr, key=lambda x: len(x[0]), reverse=True)
     return sorted_arr
 
+def index_segments(segments, skip=('"', "'")) -> dict:
+    """ Maps texts of the split file to queues of their positions in file order,
+        so each database row takes the first unused occurrence of its original.
+    """
+    positions = dict()
+    for i, segment in enumerate(segments):
+        if segment is None or segment in skip: continue
+        queue = positions.get(segment)
+        if queue is None:
+            positions[segment] = queue = deque()
+        queue.append(i)
+    return positions
+
+def make_attribute_lookups(alines, strip_comments=True, drop_empty=False) -> Tuple[dict, dict]:
+    """ Makes hashed lookups of attribute translations from rows sorted by original length:
+        (block lookup, separated item lookup) with the results of the former sequential scans.
+        In blocks a translation equal to the original of a later row is translated again and
+        commented out rows are skipped; separated items take the first row of the original.
+        Empty translations stop the lookup unless drop_empty is set.
+    """
+    positions = dict()
+    item_lookup = dict()
+    for i, row in enumerate(alines):
+        if len(row) < 2: continue
+        item_lookup.setdefault(row[0], row[1])
+        if strip_comments and row[0][:len(COMMENT_TAG)] == COMMENT_TAG and row[1][:len(COMMENT_TAG)] != COMMENT_TAG:
+            continue
+        positions.setdefault(row[0], []).append(i)
+    if not drop_empty:
+        item_lookup = {original: translated for original, translated in item_lookup.items() if translated != ''}
+
+    def resolve(item):
+        pos = 0
+        while True:
+            indexes = positions.get(item)
+            k = bisect.bisect_left(indexes, pos) if indexes else 0
+            if not indexes or k == len(indexes):
+                return item
+            translated = alines[indexes[k]][1]
+            if not translated and not drop_empty:
+                return item
+            item = translated
+            pos = indexes[k] + 1
+
+    return {original: resolve(original) for original in positions}, item_lookup
+
+def split_binary_encoding(file_enc):
+    """ Returns (original, translation) encodings of a binary from "enc" or "original enc,translation enc" """
+    encodings = [enc.strip() for enc in file_enc.split(',') if enc.strip()] or ["utf-8"]
+    # plain utf-16 would add BOMs to every encoded string
+    encodings = ["utf-16-le" if enc.lower() == "utf-16" else enc for enc in encodings]
+    return encodings[0], encodings[-1]
+
+def _makeBinaryStrings(self, file_name, upgrade=False, lang="JA", name_duplicate=False) -> int:
+    """ Creates or upgrades translation database of zero-terminated strings from a binary file;
+        every row records where the string is as "hex offset,encoding,filler,length in bytes".
+    """
+    onlyName = file_name if name_duplicate else os.path.splitext(file_name)[0]
+    new_name = onlyName + STRINGS_DB_POSTFIX
+    old_list = []
+    if upgrade:
+        backup_strings = onlyName + "_" + STRINGS_NAME + ".old"
+        if os.path.isfile(new_name) and not os.path.isfile(backup_strings):
+            move(new_name, backup_strings)
+        old_list = read_csv_list(backup_strings)
+    old_rows = dict() # originals without comment tags to old [original, translation, context, place]
+    for row in old_list:
+        is_commented = row[0][:len(COMMENT_TAG)] == COMMENT_TAG
+        old_rows.setdefault(row[0][len(COMMENT_TAG):] if is_commented else row[0], (row + [''] * 3)[:4])
+
+    origin_enc, out_enc = split_binary_encoding(self.file_enc)
+    with open(file_name, 'rb') as f:
+        data = f.read()
+
+    rows = []
+    for start, end in string_sections(data):
+        for offset, text, length in extract_strings(data, origin_enc, start, end):
+            if CARRIAGE_RETURN in text: continue # would break the database lines
+            if len(lang) and not is_in_language(text, lang): continue
+            if self.re_excl and self.re_excl.search(text): continue
+            original, translation, _, place = old_rows.get(text, (text, '', '', ''))
+            # encoding and filler set by hand are kept, only offset and length are new
+            _a = [l.strip() for l in place.split(',') if l.strip()]
+            _enc = _a[1] if len(_a) > 1 else out_enc
+            _filler = _a[2] if len(_a) > 2 else '\\0'
+            rows.append([original, translation, '', f"{offset:#x},{_enc},{_filler},{length}"])
+
+    if not rows: return 0
+    print(" %d %s;" % (len(rows), STRINGS_NAME), end='', flush=True)
+    write_csv_list(new_name, rows)
+    return len(rows)
+
 def _applyTranslationsToBinary(self, file_name, mode=1, name_duplicate=False) -> bool:
     outputName = self.getOutputName(file_name)
     if not os.path.exists(file_name) or (os.path.exists(outputName) and not (self.use_game_dir or (mode & 2))):
@@ -1269,88 +1652,82 @@ def _applyTranslationsToBinary(self, file_name, mode=1, name_duplicate=False) ->
     if not os.path.exists(translationsFile):
         return False
 
-    out_dict = read_csv_list(os.path.join(self.work_dir, TRANSLATION_OUT_DB))
+    out_dict = get_out_dictionary(os.path.join(self.work_dir, TRANSLATION_OUT_DB))
     translation = sort_by_first_column_length(read_csv_list(translationsFile))
 
-    out_enc = self.file_enc.split(',')
-    if len(out_enc) == 1:
-        origin_enc = out_enc = out_enc[0]
-    elif len(out_enc) > 1:
-        origin_enc = out_enc[0]
-        out_enc = out_enc[1]
-    else:
-        origin_enc = out_enc = "utf-8"
-
-    if out_enc == "utf-16":
-        out_enc == "utf-16-le"
+    origin_enc, out_enc = split_binary_encoding(self.file_enc)
 
     zero_char = '\0'.encode(out_enc)
-    zero_char_len = len(zero_char)
 
     with open(file_name, 'rb') as f:
-        bstr = f.read()
-        _hash = md5(bstr).hexdigest()
-
-        for line in translation:
-            if len(line) < 2 or not line[1]: continue
-
-            tmp_str = line[1]
-            origin_str = line[0]
-            if (mode & 4):
-                for dict_line in out_dict:
-                    if len(dict_line[0]) == 0: continue
-                    repl = re.compile(dict_line[0])
-                    tmp_str = re.sub(repl, dict_line[1], tmp_str)
-                    origin_str = re.sub(repl, dict_line[1], origin_str)
-
-            if self.escape_dquo_a:
-                tmp_str = tmp_str.replace('"', '\\"')
-
-            _offset_mode = len(line) > 3 and line[3] is not None and line[3].strip() != ''
-            _filler = '\0'
-
-            if _offset_mode:
-                # line[3] since [2] is reserved for context
-                _a = [l.strip() for l in line[3].split(',') if l.strip()]
-                #example of the third csv column (offset, encoding, filler) is:
-                #  [0x0011aa][,utf-16le][, \x20]
-                if len(_a) > 0:
-                    if _a[0]:
-                        offset = int(_a[0], 16)
-                        if isnan(offset):
-                            _offset_mode = False
-                    else:
+        patcher = BinaryPatcher(f.read())
+
+    for line in translation:
+        if len(line) < 2 or not line[1]: continue
+
+        tmp_str = line[1]
+        origin_str = line[0]
+        if (mode & 4):
+            tmp_str = out_dict.sub(tmp_str)
+            origin_str = out_dict.sub(origin_str)
+
+        if self.escape_dquo_a:
+            tmp_str = tmp_str.replace('"', '\\"')
+
+        _offset_mode = len(line) > 3 and line[3] is not None and line[3].strip() != ''
+        _filler = '\0'
+        _enc = out_enc
+        _length = None
+
+        if _offset_mode:
+            # line[3] since [2] is reserved for context
+            _a = [l.strip() for l in line[3].split(',') if l.strip()]
+            #example of the third csv column (offset, encoding, filler, original length) is:
+            #  [0x0011aa][,utf-16le][, \x20][,12]
+            if len(_a) > 0:
+                if _a[0]:
+                    offset = int(_a[0], 16)
+                    if isnan(offset):
                         _offset_mode = False
-                    if len(_a) > 1:
-                        out_enc = _a[1]
-                    if len(_a) > 2:
-                        _filler = string_unescape(_a[2])
                 else:
                     _offset_mode = False
-
-            _orig_str = origin_str.encode(origin_enc)
-            _orig_len = len(_orig_str)
-            tmp_str = make_same_size(tmp_str, _orig_len, out_enc, _filler)
-            #new_translation.append([line[0], tmp_str.strip('\0')]) # actually applied translations
-            if _offset_mode:
-                # can't fallback to generic replacer in offset mode since the string may be too short
-                #print(f"{hex(offset)}: {bstr[offset:offset+_orig_len]} == {_orig_str}")
-                if bstr[offset:offset+_orig_len] == _orig_str:
-                    bstr = bstr[:offset] + tmp_str.encode(out_enc) + bstr[offset+_orig_len:]
+                if len(_a) > 1:
+                    _enc = _a[1]
+                if len(_a) > 2:
+                    _filler = string_unescape(_a[2])
+                if len(_a) > 3:
+                    try:
+                        _length = int(_a[3])
+                    except ValueError:
+                        patcher.skip(offset if _offset_mode else None, line[0], f"bad length {_a[3]!r}")
+                        continue
             else:
-                # this is more reliable as it doesn't depend on the file's version
-                # but strings need to be long enough to be unique
-                bstr = bstr.replace(_orig_str + zero_char, tmp_str.encode(out_enc) + zero_char, 1)
-
-        if _hash != md5(bstr).hexdigest():
-            pathOut = os.path.dirname(outputName)
-            if pathOut != '' and not os.path.exists(pathOut):
-                os.makedirs(pathOut, exist_ok=True)
-
-            with open(outputName, 'wb') as o:
-                o.write(bstr)
-            return True
-    return False
+                _offset_mode = False
+
+        _orig_str = origin_str.encode(origin_enc)
+        if _offset_mode and _length is not None and _length != len(_orig_str):
+            patcher.skip(offset, line[0], f"{len(_orig_str)} bytes instead of recorded {_length}")
+            continue
+        tmp_str = make_same_size(tmp_str, len(_orig_str), _enc, _filler).encode(_enc)
+        if _offset_mode:
+            # can't fallback to generic replacer in offset mode since the string may be too short
+            patcher.add_at(offset, _orig_str, tmp_str, line[0])
+        else:
+            # this is more reliable as it doesn't depend on the file's version
+            # but strings need to be long enough to be unique
+            patcher.add(_orig_str + zero_char, tmp_str + zero_char, line[0])
+
+    is_patched = patcher.apply() > 0
+    if patcher.skipped or patcher.ambiguous:
+        print('\n' + patcher.report())
+    if is_patched:
+        pathOut = os.path.dirname(outputName)
+        if pathOut != '' and not os.path.exists(pathOut):
+            os.makedirs(pathOut, exist_ok=True)
+
+        with open(outputName, 'wb') as o:
+            o.write(patcher.data)
+    return is_patched
 
 def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_binary=False, drop_empty=False) -> bool:
     """ Applies translations from translation databases to game files and images
@@ -1390,7 +1767,7 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
         return False
 
     print_progress(0, 100)
-    out_dict = read_csv_list(os.path.join(self.work_dir, TRANSLATION_OUT_DB))
+    out_dict = get_out_dictionary(os.path.join(self.work_dir, TRANSLATION_OUT_DB))
 
     torg_text = u''
     is_win_linenedings = False
@@ -1423,7 +1800,8 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
                 split_torg_text = [a for i, a in enumerate(split_torg_text)
                                    if a is not None and i % (gc + 1) != ci]
 
-            last_pos = 0
+            positions = index_segments(split_torg_text)
+            i = 0
             for row in reader:
                 forig_t_lines += 1
                 try:
@@ -1442,24 +1820,15 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
                 if self.strip_comments and row[0][:len(COMMENT_TAG)] == COMMENT_TAG and tmp_str[:len(COMMENT_TAG)] != COMMENT_TAG: continue
 
                 if (mode & 4):
-                    for dict_line in out_dict:
-                        if len(dict_line[0]) == 0: continue
-                        repl = re.compile(dict_line[0])
-                        tmp_str = re.sub(repl, dict_line[1], tmp_str)
+                    tmp_str = out_dict.sub(tmp_str)
 
                 if self.escape_dquo_a:
                     tmp_str = tmp_str.replace('"', '\\"')
 
-                # don't check all text
-                for i in range(last_pos, len(split_torg_text)):
-                    orig_ln = split_torg_text[i]
-                    if orig_ln == '"' or orig_ln == "'": continue
-                    if orig_ln == row[0]:
-                        if not tmp_str and mode & 16: break
-                        split_torg_text[i] = tmp_str
-                        new_pos =  i-LOOKBEHIND_LINES * re_s.groups
-                        last_pos = max(0, new_pos)
-                        break
+                queue = positions.get(row[0])
+                if queue and (tmp_str or not mode & 16):
+                    i = queue.popleft()
+                    split_torg_text[i] = tmp_str
                 #last_line_continues = (len(re.findall(re_endline, row[1][-3:])) > 0)
                 if not apply_txt:
                     apply_txt = True
@@ -1494,11 +1863,10 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
                 err_flag = False
 
             if mode & 8:
-                for dict_line in out_dict:
-                    repl = re.compile(dict_line[0])
-                    row[1] = repl.sub(dict_line[1], row[1])
+                row[1] = out_dict.sub_all(row[1])
 
         alines = sort_by_first_column_length(alines)
+        block_lookup, item_lookup = make_attribute_lookups(alines, self.strip_comments, drop_empty)
 
         # quotes can be escaped manually with -rit command line parameter
         # TODO: cmdline opt to make first attribute letter uppercase and rest - lowercase
@@ -1527,14 +1895,7 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
                 while found is not None:
                     prefix = original_match[current:first]
                     if len(prefix): text_spans.append(prefix)
-                    item = found
-
-                    for row in alines:
-                        if self.strip_comments and row[0][:len(COMMENT_TAG)] == COMMENT_TAG and row[1][:len(COMMENT_TAG)] != COMMENT_TAG: continue
-                        if item == row[0]:
-                            if not row[1] and not drop_empty:
-                                break
-                            item = row[1]
+                    item = block_lookup.get(found, found)
                     if len(item): text_spans.append(item)
                     i, found = next(found_groups, (0, None))
                     if i != 0:
@@ -1556,13 +1917,10 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
             attr_text = match.group(1)
 
             if not len(attr_text): return match[0]
-            for row_inner in alines:
-                if len(attr_text):
-                    if attr_text == row_inner[0]:
-                        if row_inner[1] == '' and not drop_empty:
-                            break
-                        return match[0].replace(attr_text, row_inner[1])
-            return match[0]
+            translated = item_lookup.get(attr_text)
+            if translated is None:
+                return match[0]
+            return match[0].replace(attr_text, translated)
 
         torg_text = re.sub(re_a, attr_block_replacer_fn, torg_text)
         if forig_a_lines: apply_att = True
@@ -1570,9 +1928,7 @@ def _applyTranslationsToFile(self, file_name, mode=1, name_duplicate=False, is_b
     print_progress(90, 100)
 
     if apply_att and (mode & 16):
-        for dict_line in out_dict:
-            repl = re.compile(dict_line[0])
-            torg_text = repl.sub(dict_line[1], torg_text)
+        torg_text = out_dict.sub_all(torg_text)
 
     print_progress(95, 100)
 
@@ -1737,7 +2093,12 @@ class FileTranslate:
         self.strip_comments = strip_cmts
 
     translateCSV = translateCSV
+    getJournal = _getJournal
+    translateDuplicates = _translateDuplicates
+    importTranslations = _importTranslations
+    getTextToTranslate = _getTextToTranslate
     makeTranslatableStrings = _makeTranslatableStrings
+    makeBinaryStrings = _makeBinaryStrings
     applyFixesToTranslation = _applyFixesToTranslation
     getOutputName = _getOutputName
     applyTranslationsToFile = _applyTranslationsToFile
@@ -1885,17 +2246,178 @@ def restore_translation_lines(original_lines, translated_lines, translation_type
 
     return translated_lines_all
 
-def make_text_to_translate(source_lines, translation_types):
-    """ Returns only lines that need to be translated according to translation_types
+class TranslationService:
+    """ Machine translation pipeline used by translateCSV.
+
+    Applies translation_dictionary_in, merges partial lines, checks the translation cache and
+    sends the rest to an asynchronous MTL backend (see mtlbackend.TranslatorBackend).
+    Backend requests run in a shared event loop, so with -jobs only the threads
+    that wait for the backend are blocked.
     """
-    filtered_lines = ''
-    l_orig = len(source_lines)
-    for i, line in enumerate(source_lines):
-        if translation_types[i] > 0:
-            filtered_lines += line
-            if i < l_orig - 1:
-                filtered_lines += '\n'
-    return filtered_lines
+    def __init__(self, backend, work_dir, lang_src='JA', lang_dest='EN', tr_dict_in=[], do_merge=True,
+                 not_translit_mode=False, memory=None, row_memory=None):
+        self.backend = backend
+        self.memory = memory
+        self.row_memory = row_memory # whole database rows => existing translations
+        self.work_dir = work_dir
+        self.lang_src = lang_src
+        self.lang_dest = lang_dest
+        # compiled once; gives the same text as re.sub of every entry in order
+        self.tr_dict_in = ReplacementDictionary(tr_dict_in, re.U)#|re.I|re.M)
+        self.do_merge = do_merge
+        self.not_translit_mode = not_translit_mode
+        self.limiter = RateLimiter(backend.get_rate_limits(), backend.name, ban_max_delay=TRANSLATION_BAN_DELAY)
+        self.sent_chars = 0
+        self.shared_segments = set() # memory keys of segments translated before the files (-dedup)
+        self.shared_sent_chars = 0
+        self.shared_hit_chars = 0 # characters of the shared segments later found in the memory
+        self._stats_lock = threading.Lock()
+        self._loop = EventLoopThread()
+
+    def __enter__(self):
+        self.backend.__enter__()
+        self.limiter.name = self.backend.name # the backend may be renamed by its server
+        self._loop.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._loop.stop()
+        if self.limiter.throttled_time:
+            print(self.limiter.report())
+        if self.memory and self.memory.hits:
+            print(self.memory.report())
+        if self.row_memory and self.row_memory.hits:
+            print(self.row_memory.report())
+        if self.sent_chars:
+            cost = self.backend.estimate_cost(self.sent_chars)
+            print(f"{self.backend.name}: {self.sent_chars} characters translated" + (f" (~${cost:.2f})" if cost else ''))
+        if self.memory and isinstance(self.memory.store, TranslationStore):
+            self.memory.store.close() # row_memory shares it
+        return self.backend.__exit__(exc_type, exc_value, traceback)
+
+    def get_char_limit(self):
+        return self.backend.get_char_limit()
+
+    async def _request(self, lines):
+        n_chars = sum(len(line) + 1 for line in lines)
+        while True:
+            await self.limiter.acquire(n_chars)
+            try:
+                transl_lines = await self.backend.translate_batch(lines, self.lang_src, self.lang_dest)
+                self.limiter.on_success()
+                self.sent_chars += n_chars
+                return transl_lines
+            except Exception as e:
+                delay = self.limiter.on_failure(e)
+                print(f"{e} (retrying in {delay:.0f}s)", end='\r')
+
+    def _split_request(self, lines):
+        """ Splits lines to requests within the backend character and line limits """
+        max_chars = self.backend.get_char_limit()
+        max_lines = self.backend.get_batch_limit()
+        batches = [[]]
+        size = 0
+        for line in lines:
+            if batches[-1] and (size + len(line) + 1 > max_chars or max_lines and len(batches[-1]) >= max_lines):
+                batches.append([])
+                size = 0
+            batches[-1].append(line)
+            size += len(line) + 1
+        return batches
+
+    async def _request_all(self, lines):
+        """ Sends the requests concurrently (up to backend's max_concurrency) and joins their results """
+        results = await asyncio.gather(*(self._request(batch) for batch in self._split_request(lines)))
+        return [line for result in results for line in result]
+
+    def prepare_segments(self, lines_array, is_seq_strings=False, merging_que_arr=[], allow_merge=True):
+        """ Returns (source lines, translation types, segments to translate) of a batch of strings
+            after translation_dictionary_in and merging of partial lines
+        """
+        # we need join -> split because there can be multiline items in lines_array
+        # in which case l_orig_lines != len(lines_array)
+        text_to_translate = '\n'.join(lines_array) + '\n'
+
+        # apply pre-translations from dictionary [jpn] -> [jpn; eng]
+        text_to_translate = self.tr_dict_in.sub(text_to_translate)
+
+        l_orig_lines = text_to_translate.splitlines()
+        translation_types = make_translation_types(
+            l_orig_lines, self.lang_src, is_seq_strings, self.not_translit_mode, self.do_merge and allow_merge,
+            merging_que_arr
+        )
+        segments = [line for i, line in enumerate(l_orig_lines) if translation_types[i] > 0]
+        return l_orig_lines, translation_types, segments
+
+    def translate_segments(self, segments, share=False):
+        """ Translates prepared segments; returns (1 if MTL was used else 0, translations).
+            With share the segments sent to MTL are counted as translated for other files (see -dedup).
+        """
+        # one-liners and merged segments are looked up in the translation memory,
+        # only misses are sent to the translator
+        transl_text = self.memory.get_many(segments) if self.memory else [None] * len(segments)
+        missed = [i for i, item in enumerate(transl_text) if item is None]
+        if self.shared_segments and not share:
+            hit_chars = sum(len(segment) for segment, item in zip(segments, transl_text)
+                            if item is not None and self.memory.normalize(segment) in self.shared_segments)
+            with self._stats_lock:
+                self.shared_hit_chars += hit_chars
+
+        ttype = 0
+        if missed:
+            #print(PROGRESS_CHAR, end='', flush=True)
+            missed_segments = [segments[i] for i in missed]
+            transl_missed = self._loop.run(self._request_all(missed_segments))
+            if len(transl_missed) != len(missed):
+                self._write_error_log(missed_segments, transl_missed, [1] * len(missed))
+                raise Exception(f"\nERROR: Mismatch in translated line counts, sent={len(missed)} " +
+                                f"received={len(transl_missed)}, error_translations.txt written.")
+            for i, line in zip(missed, transl_missed):
+                transl_text[i] = line
+            # empty or punctuation-only results are strange so they aren't remembered
+            remembered = [i for i, line in enumerate(transl_missed) if
+                          len(re.sub(r'[\r\n \t.,;!?\u3000]', '', line)) > 0]
+            if self.memory:
+                self.memory.set_many([missed_segments[i] for i in remembered],
+                                     [transl_missed[i] for i in remembered])
+                if share:
+                    with self._stats_lock:
+                        self.shared_segments.update(self.memory.normalize(missed_segments[i]) for i in remembered)
+                        self.shared_sent_chars += sum(len(missed_segments[i]) for i in remembered)
+            ttype = 1
+        return ttype, transl_text
+
+    def translate(self, lines_array, is_seq_strings=False, merging_que_arr=[], allow_merge=True):
+        """ Translates a batch of strings; returns (1 if MTL was used else 0, translated lines) """
+        if len(('\n'.join(lines_array) + '\n').strip()) == 0: return (0, lines_array)
+
+        l_orig_lines, translation_types, segments = self.prepare_segments(
+            lines_array, is_seq_strings, merging_que_arr, allow_merge)
+        l_orig = len(l_orig_lines)
+        ttype, transl_text = self.translate_segments(segments)
+
+        # restore empty lines
+        transl_text_full = restore_translation_lines(
+            l_orig_lines, transl_text, translation_types, self.not_translit_mode, self.lang_dest)
+        l_tran = len(transl_text_full)
+        if l_orig != l_tran:
+            self._write_error_log(l_orig_lines, transl_text_full, translation_types)
+            raise Exception(f"\nERROR: Mismatch in translated line counts, original={l_orig} " +
+                            "new={l_tran}, error_translations.txt written.")
+
+        return (ttype, transl_text_full)
+
+    def _write_error_log(self, orig_lines, transl_lines, translation_types):
+        lines = ''
+        for i, line in enumerate(transl_lines):
+            try:
+                lines += orig_lines[i]
+                lines += f" -({translation_types[i]})-> "
+            except: pass
+            lines += line + '\n'
+        with open(os.path.join(self.work_dir, 'error_translations.log'), 'w', encoding=CSV_ENCODING) as dtxt:
+            dtxt.write(lines)
+
 
 def is_file_changed(file_path: str) -> bool:
     global cache
@@ -1941,6 +2463,10 @@ def return_ony_changed(files: list):
 
     return duplicates, filtered_files
 
+def translator_arg(value):
+    """ Argument type of -t/-tu/-tdct/-tdctu: number of the translator (0 is off) or its name """
+    return int(value) if value.isdigit() else value
+
 
 # ---------------------------------------------- plans -----------------------------------------------
 # TODO:
@@ -2041,6 +2567,10 @@ def main():
     parser.add_argument("-pf_pat", default="%s: %s", help="Sets format for string pre-formatting with context (ex/def: %%s: %%s)", metavar=("preformat"))
     parser.add_argument("-pf", action="store_true", help="Enables pre-formatting of strings sent to MTL to mix context in them")
     parser.add_argument("-ts", action="store_true", help="Check .csv files for changes and process only changed")
+    parser.add_argument("-cache-stats", action="store_true", help="Show translation memory statistics: size, hits and misses (FILETRANSLATE_TM or ~/.filetranslate/)")
+    parser.add_argument("-warm", action="store_true", help="Reuse existing .csv and .old translations of the project for the same untranslated rows with -t/-tu")
+    parser.add_argument("-dedup", action="store_true", help="Translate lines repeated across files once before -t/-tu")
+    parser.add_argument("-jobs", type=int, default=1, help="Number of files translated concurrently with -t/-tu (ex/def: 1)", metavar=("N"))
 
     regroup = parser.add_argument_group("file regexps")
     regroup.add_argument("-ra", help="RegExp for attributes", default='', metavar=("attr_regexp"))
@@ -2052,11 +2582,11 @@ def main():
     optgroup.add_argument("-i", help="Initialize translation files", action="store_true")
     optgroup.add_argument("-u", help="Update translation files for new strings", action="store_true")
     optgroup.add_argument("-ocr", help="Perform text recognition for images (1: default, 2: invert, 4: binarize; can be sum)", type=int, nargs='?', const=1, default=0, metavar="OPT")
-    tn_opts = "(default:" + ','.join([f"{tn.value}={tn.name}" for tn in TransNum]) + ")"
+    tn_opts = f"(number or name, default:{format_backends()})"
     optgroup.add_argument(
-        "-t", help=f"Perform initial string translation {tn_opts}", type=int, nargs='?', const=1, default=0, metavar="MTL")
+        "-t", help=f"Perform initial string translation {tn_opts}", type=translator_arg, nargs='?', const=1, default=0, metavar="MTL")
     optgroup.add_argument(
-        "-tu", help=f"Perform translation of new strings {tn_opts}", type=int, nargs='?', const=1, default=0, metavar="MTL")
+        "-tu", help=f"Perform translation of new strings {tn_opts}", type=translator_arg, nargs='?', const=1, default=0, metavar="MTL")
     optgroup.add_argument(
         "-fix", help="Revert replacement tags and apply translation_dictionary_out to translation",
         action="store_true")
@@ -2101,9 +2631,9 @@ def main():
         "-dct", help="Make dictionary file from all original words (1:strings (def), 2:+attributes)",
         type=int, nargs='?', const=2, default=0, metavar="type")
     intsgroup.add_argument(
-        "-tdct", help="Translate dictionary file", type=int, nargs='?', const=1, default=0, metavar="MTL")
+        "-tdct", help="Translate dictionary file", type=translator_arg, nargs='?', const=1, default=0, metavar="MTL")
     intsgroup.add_argument(
-        "-tdctu", help="Update translation of dictionary file", type=int, nargs='?', const=1, default=0, metavar="MTL")
+        "-tdctu", help="Update translation of dictionary file", type=translator_arg, nargs='?', const=1, default=0, metavar="MTL")
     intsgroup.add_argument(
         "-csvm", help="Merge all csv's into a single file", action="store_true")
 
@@ -2136,6 +2666,12 @@ def main():
         return
     app_args = parser.parse_args()
 
+    if app_args.cache_stats:
+        tm_store = TranslationStore(max_size=TM_MAX_SIZE)
+        print(tm_store.report())
+        tm_store.close()
+        return
+
     patterns = list(filter(None, app_args.p.split(',')))
     is_pattern_manual = (len(patterns) > 0)
     file_encoding = app_args.e
@@ -2204,18 +2740,16 @@ def main():
     MT = None
     if is_translation or app_args.tdct or app_args.tdctu:
         # MTL bans you if you free-use it faster than N (>5000) chars per T (>10) sec
-        # The following methods to be implemented within a custom translator's class
+        # Backends implement mtlbackend.TranslatorBackend with their own limits
         n_trans = is_translation or app_args.tdct or app_args.tdctu
-
-        if n_trans == TransNum.googlet:
-            from googletrans import Translator
-            print("Using native\033[1m Python Google\033[0m translator...")
-        elif n_trans == TransNum.sugoi:
-            from sugoitranslate import SugoiTranslate
-            print("Using \033[1mSugoi\033[0m translator...")
-            Translator = SugoiTranslate
-        else:
-            raise Exception("Unknown translator specified")
+        try:
+            trans_name = resolve_backend_name(n_trans)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Using \033[1m{trans_name}\033[0m translator...")
+        backend = load_backend(trans_name)
+        print(f" ({describe_backend(backend)})")
 
         if app_args.remnl:
             print(" (Newlines will be stripped from source strings)")
@@ -2225,123 +2759,23 @@ def main():
 
         tr_dict_in = read_csv_list(os.path.join(working_dir, TRANSLATION_IN_DB))
 
-        # MTL bans you if you free-use it faster than N (>2000) chars per T (>20) sec
-        # The following methods can be implemented within a custom translator's class
-        if not hasattr(Translator, "wait"):
-            def wait(self): sleep(20)
-            Translator.wait = wait
-        if not hasattr(Translator, "get_char_limit"):
-            def get_char_limit(self): return 2000
-            Translator.get_char_limit = get_char_limit
-        if not hasattr(Translator, "on_finish"):
-            def on_finish(self):
-                if cache is not None:
-                    cache.clear()
-                return
-            Translator.on_finish = on_finish
-
-        #define for external translators that don't support it
-        if not hasattr(Translator, "__enter__"):
-            def __enter__(self):
-                return self
-            MT.__enter__ = __enter__
-        if not hasattr(Translator, "__exit__"):
-            def __exit__(self, exc_type, exc_value, traceback):
-                return None
-            MT.__exit__ = __exit__
-
-        Translator._first_time_translate = True
-        if hasattr(Translator, "translate"):
-            translate_old = Translator.translate
-            not_translit_mode = False
-
-            def translate_new(self, lines_array, is_seq_strings=False, merging_que_arr=[]):
-                text_to_translate = '\n'.join(lines_array) + '\n'
-                if len(text_to_translate.strip()) == 0: return (0, lines_array)
-
-                transl_text = ''
-                text_is_long_enough = len(text_to_translate) > CACHE_MIN_TEXT_LENGTH
-                text_block_hash = None
-                if ENABLE_CACHE and text_is_long_enough:
-                    text_block_hash = md5(text_to_translate.encode("utf-8")).hexdigest()
-                    transl_text = cache.get(text_block_hash)
-                    if transl_text is not None:
-                        #print(PROGRESS_OTHER_CHAR, end='', flush=True)
-                        return (0, transl_text)
-                    else:
-                        transl_text = ''
-
-                # we need join -> split because there can be multiline items in lines_array
-                # in which case l_orig_lines != len(lines_array)
-                del lines_array
-
-                # apply pre-translations from dictionary [jpn] -> [jpn; eng]
-                for dict_line in tr_dict_in:
-                    if len(dict_line) < 1: continue
-                    replacer = '' if dict_line[1] is None else dict_line[1]
-                    text_to_translate = re.sub(dict_line[0], replacer, text_to_translate, flags=re.U)#|re.I|re.M)
-
-                l_orig_lines = text_to_translate.splitlines()
-                l_orig = len(l_orig_lines)
-
-                translation_types = make_translation_types(
-                    l_orig_lines, lang_src, is_seq_strings, not_translit_mode, do_merge, merging_que_arr
-                )
-                text_to_translate = make_text_to_translate(l_orig_lines, translation_types)
-
-                #print(PROGRESS_CHAR, end='', flush=True)
-                if not self._first_time_translate and l_orig != 1:
-                    self.wait()
-                else:
-                    self._first_time_translate = False
-
-                while True:
-                    try:
-                        if n_trans == TransNum.googlet:
-                            transl_text = translate_old(self, text_to_translate, src=lang_src, dest=lang_dest).text
-                        else:
-                            transl_text = translate_old(self, text_to_translate, src=lang_src, dest=lang_dest)
-                        break
-                    except Exception as e:
-                        print(str(e), end='\r')
-                        sleep(TRANSLATION_BAN_DELAY)
-
-                tr_txt_len = len(re.sub(r'[\r\n \t.,;!?\u3000]', '', transl_text))
-                transl_text = transl_text.splitlines()
-
-                # restore empty lines
-                transl_text_full = restore_translation_lines(
-                    l_orig_lines, transl_text, translation_types, not_translit_mode, lang_dest)
-                l_tran = len(transl_text_full)
-                if l_orig != l_tran:
-                    lines = ''
-                    for i, line in enumerate(transl_text_full):
-                        try:
-                            lines += l_orig_lines[i]
-                            lines += f" -({translation_types[i]})-> "
-                        except: pass
-                        lines += line + '\n'
-                    with open(os.path.join(working_dir, 'error_translations.log'), 'w', encoding=CSV_ENCODING) as dtxt:
-                        dtxt.write(lines)
-                    raise Exception(f"\nERROR: Mismatch in translated line counts, original={l_orig} " +
-                                    "new={l_tran}, error_translations.txt written.")
-
-                # if the translation result is shorter don't cache it, it's strange
-                if ENABLE_CACHE and (text_block_hash is not None) and text_is_long_enough and (tr_txt_len > CACHE_MIN_TEXT_LENGTH):
-                    tagstr = TransNum(n_trans).name
-                    cache.set(text_block_hash, transl_text_full, expire=CACHE_EXPIRY_TIME, tag=tagstr)
-
-                return (1, transl_text_full)
-
-            Translator.translate = translate_new
-
-        MT = None
-        if n_trans == TransNum.googlet:
-            MT = Translator(raise_exception=True)
-        elif n_trans == TransNum.sugoi:
-            MT = Translator(by_line=True)
-        else:
-            MT = Translator()
+        # without the persistent store translations are remembered only during the run
+        tm_store = dict()
+        if USE_TM:
+            try:
+                tm_store = TranslationStore(max_size=TM_MAX_SIZE)
+            except Exception as e:
+                print(f"Translation memory is unavailable: {e}")
+        # the name is read when the memory is used since a Sugoi server reports its model on entering
+        memory = TranslationMemory(tm_store, backend, f"{lang_src}-{lang_dest}")
+        row_memory = None
+        if app_args.warm:
+            # rows are reused only inside the same project
+            project_id = md5(os.path.abspath(working_dir).encode('utf-8')).hexdigest()
+            row_memory = TranslationMemory(tm_store, f"{ROWS_TM_NAMESPACE}:{project_id}", f"{lang_src}-{lang_dest}",
+                                           exact=True)
+        MT = TranslationService(backend, working_dir, lang_src, lang_dest, tr_dict_in, do_merge,
+                                memory=memory, row_memory=row_memory)
         print("Starting time: {}".format(datetime.datetime.now().strftime("%H:%M %d.%m.%Y")))
 
 
@@ -2441,7 +2875,7 @@ def main():
         else:
             print("Updating dictionary translation... ")
         with MT as m:
-            res = FT.translateCSV(m, os.path.join(working_dir, DICTIOANRY_FILE), False, upgrade=app_args.tdctu)
+            res = FT.translateCSV(m, os.path.join(working_dir, DICTIOANRY_FILE), False, upgrade=bool(app_args.tdctu))
             #m.on_finish()
         return
 
@@ -2480,35 +2914,76 @@ def main():
     array_csv_attrs = []
     array_csv_strs = []
     if is_translation:
-        with MT as m:
-            for i, currentFile in enumerate(matchingFileList):
-                if not(os.path.isfile(currentFile) and os.access(currentFile, os.R_OK)):
-                    print("WARNING: File does not exist or not accessible: " + currentFile)
-                    continue
-                fileAllCount += 1
-                res = 0
-                base_name = currentFile.replace(working_dir, '')
-                base_name_print = f"{base_name} ({fileAllCount} of {totalCount})"
-                currentFile = os.path.abspath(currentFile)
-                only_name = os.path.splitext(currentFile)[0]
-                if any((s in currentFile) for s in [os.path.basename(__file__), TRANSLATION_IN_DB, TRANSLATION_OUT_DB, INTERSECTIONS_FILE, GAME_REGEXP_DB, "replacers.csv", "requirements"]):
-                    continue
+        translation_jobs = []
+        for i, currentFile in enumerate(matchingFileList):
+            if not(os.path.isfile(currentFile) and os.access(currentFile, os.R_OK)):
+                print("WARNING: File does not exist or not accessible: " + currentFile)
+                continue
+            fileAllCount += 1
+            base_name = currentFile.replace(working_dir, '')
+            base_name_print = f"{base_name} ({fileAllCount} of {totalCount})"
+            currentFile = os.path.abspath(currentFile)
+            only_name = os.path.splitext(currentFile)[0]
+            if any((s in currentFile) for s in [os.path.basename(__file__), TRANSLATION_IN_DB, TRANSLATION_OUT_DB, INTERSECTIONS_FILE, GAME_REGEXP_DB, "replacers.csv", "requirements"]):
+                continue
+
+            if duplicateList[i]:
+                only_name = currentFile
+
+            text = ''
+            if app_args.t: text = f"Translating {base_name_print} ...\n"
+            else: text = f"Updating translation of {base_name_print} ...\n"
+            translation_jobs.append((only_name, text))
 
-                if duplicateList[i]:
-                    only_name = currentFile
-
-                text = ''
-                if app_args.t: text = f"Translating {base_name_print} ...\n"
-                else: text = f"Updating translation of {base_name_print} ...\n"
-                print(text, end='', flush=True)
-
-                res = FT.translateCSV(m, only_name + ATTRIBUTES_DB_POSTFIX, False, upgrade=app_args.tu)
-                res += FT.translateCSV(m, only_name + STRINGS_DB_POSTFIX, True, upgrade=app_args.tu)
-                if res:
-                    print("\033[F" + text.rstrip('\n') + ' ' + str(res) +' lines\n', end='', flush=True)
-                res = res > 0
-                if res:
-                    fileCount += 1
+        n_jobs = max(1, min(app_args.jobs, len(translation_jobs)))
+        with MT as m:
+            if app_args.warm:
+                print("Loading existing translations to the translation memory...")
+                print(f"{FT.importTranslations(m.row_memory)} translated rows loaded")
+            if app_args.dedup:
+                print("Translating lines repeated across files...")
+                n_repeated, n_dedup_chars = FT.translateDuplicates(m, [only_name + postfix
+                    for only_name, _ in translation_jobs for postfix in [ATTRIBUTES_DB_POSTFIX, STRINGS_DB_POSTFIX]],
+                    upgrade=bool(app_args.tu))
+                print(f"Deduplication: {n_repeated} unique repeated segments, {n_dedup_chars} characters sent")
+
+            def translate_file(only_name):
+                res = FT.translateCSV(m, only_name + ATTRIBUTES_DB_POSTFIX, False, upgrade=bool(app_args.tu))
+                res += FT.translateCSV(m, only_name + STRINGS_DB_POSTFIX, True, upgrade=bool(app_args.tu))
+                return res
+
+            if n_jobs > 1:
+                # files are translated in parallel but reported in the same order as sequentially
+                print(f"Translating {len(translation_jobs)} files in {n_jobs} jobs...")
+                set_progress_enabled(False)
+                pool = ThreadPoolExecutor(max_workers=n_jobs)
+                try:
+                    for (only_name, text), res in zip(translation_jobs, pool.map(
+                            translate_file, [job[0] for job in translation_jobs])):
+                        print(text.rstrip('\n') + (f' {res} lines' if res else ''), flush=True)
+                        if res > 0:
+                            fileCount += 1
+                except BaseException:
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    raise
+                finally:
+                    set_progress_enabled(True)
+                pool.shutdown()
+            else:
+                for only_name, text in translation_jobs:
+                    print(text, end='', flush=True)
+                    res = translate_file(only_name)
+                    if res:
+                        print("\033[F" + text.rstrip('\n') + ' ' + str(res) +' lines\n', end='', flush=True)
+                    res = res > 0
+                    if res:
+                        fileCount += 1
+            if app_args.dedup and n_repeated:
+                # copies of the repeated segments that were found in the memory instead of sent
+                print(f"Deduplication: {m.shared_hit_chars} characters of repeated segments reused, "
+                      f"{m.shared_hit_chars - n_dedup_chars} characters saved")
+        if parse_cache.hits:
+            print(parse_cache.report())
     else:
         for i, currentFile in enumerate(matchingFileList):
             if not(os.path.isfile(currentFile) and os.access(currentFile, os.R_OK)):
@@ -2577,8 +3052,10 @@ def main():
                     print("Upgrading strings " + base_name_print + ' :', end='', flush=True)
                 else:
                     print("Making strings " + base_name_print + ' :', end='', flush=True)
+                is_bin = any(currentFile.endswith(ext) for ext in app_args.bin.split(','))
                 res = FT.makeTranslatableStrings(
-                    currentFile, app_args.u, lang_src + "_ALL" if len(lang_src) else '', name_duplicate=duplicateList[i])
+                    currentFile, app_args.u, lang_src + "_ALL" if len(lang_src) else '', name_duplicate=duplicateList[i],
+                    is_binary=is_bin)
             elif app_args.rit:
                 for csv_file in [(only_name + ATTRIBUTES_DB_POSTFIX), (only_name + STRINGS_DB_POSTFIX)]:
                     tmp = FT.replaceInTranslations(
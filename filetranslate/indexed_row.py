@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+indexed_row
+~~~~~~~~~~~
+
+Compact rows of a database split for translation.
+
+`IndexedRow` replaces the nested lists made by `split_reader_to_array`:
+    [index, n_lines, original, [[starttag, text, endtag], ...], translation, context...]
+Texts are kept in a tuple (sharing the original string when it has no tags),
+border tags in tuples of interned strings (or None for rows without tags) and
+the context columns in a tuple, so big projects take less memory and smaller
+parse cache entries. The old indexing still works:
+row[0] index, row[1] number of lines, row[2] original text, row[3] lines as
+[starttag, text, endtag] lists (a copy), row[4] translation, row[5:] context.
+"""
+__version__ = '0.1.0'
+
+import sys
+
+
+def _pack_tags(tags):
+    tags = tuple(sys.intern(tag) if tag else tag for tag in tags)
+    return tags if any(tag is not None for tag in tags) else None
+
+
+class IndexedRow():
+    """ Database row: source text split to lines with their border tags, translation and context columns.
+        Translation None with no context columns means the database row has no translation column.
+    """
+    __slots__ = ("index", "original", "texts", "stags", "etags", "translation", "extra")
+
+    def __init__(self, index, original, texts, stags=None, etags=None, translation=None, extra=()):
+        self.index = index
+        self.original = original
+        self.texts = texts
+        self.stags = stags
+        self.etags = etags
+        self.translation = translation
+        self.extra = extra
+
+    @classmethod
+    def from_lines(cls, index, original, lines, columns=()):
+        """ Makes a row from [[starttag, text, endtag], ...] lines and [translation, context...] columns """
+        # untagged one-liners share the string with the original (also in the pickled cache)
+        texts = tuple(original if line[1] == original else line[1] for line in lines)
+        return cls(index, original, texts, _pack_tags(line[0] for line in lines), _pack_tags(line[2] for line in lines),
+                   columns[0] if columns else None, tuple(columns[1:]))
+
+    @classmethod
+    def from_list(cls, row):
+        """ Makes a row from the old list layout """
+        return cls.from_lines(row[0], row[2], row[3], row[4:])
+
+    @property
+    def columns(self):
+        """ Columns after the original text as they are written to the database """
+        if self.translation is None and not self.extra:
+            return []
+        return [self.translation, *self.extra]
+
+    def to_list(self):
+        return [self.index, len(self.texts), self.original, self.lines] + self.columns
+
+    @property
+    def n_lines(self):
+        return len(self.texts)
+
+    @property
+    def lines(self):
+        return [list(self.line(k)) for k in range(len(self.texts))]
+
+    def line(self, k):
+        """ Returns (starttag, text, endtag) of k-th line """
+        return (self.stags[k] if self.stags else None, self.texts[k], self.etags[k] if self.etags else None)
+
+    @property
+    def context(self):
+        return self.extra[0] if self.extra else None
+
+    def text(self, to_original=False):
+        """ Returns text to translate (stripped texts without tags) or, with to_original,
+            the lines joined back with their tags.
+        """
+        if not to_original:
+            return '\n'.join(text.strip() for text in self.texts if text is not None)
+        lines = (''.join(filter(None, self.line(k))) for k in range(len(self.texts)))
+        if len(self.texts) == 1:
+            return next(lines)
+        ending = '' # if we capture full lines the last line should be \n terminated too
+        if self.original and self.original[-1:] == '\n':
+            ending = '\n'
+        return '\n'.join(lines) + ending
+
+    def __len__(self):
+        return 4 + len(self.columns)
+
+    def __getitem__(self, i):
+        if isinstance(i, int) and 0 <= i < 5:
+            if i == 0: return self.index
+            if i == 1: return len(self.texts)
+            if i == 2: return self.original
+            if i == 3: return self.lines
+            if self.translation is None and not self.extra:
+                raise IndexError("IndexedRow has no translation column")
+            return self.translation
+        return self.to_list()[i]
+
+    def __setitem__(self, i, value):
+        if i == 4:
+            self.translation = value
+        elif i == 0:
+            self.index = value
+        elif i == 2:
+            self.original = value
+        elif i == 3:
+            self.texts = tuple(line[1] for line in value)
+            self.stags = _pack_tags(line[0] for line in value)
+            self.etags = _pack_tags(line[2] for line in value)
+        elif isinstance(i, int) and 5 <= i < 5 + len(self.extra):
+            self.extra = self.extra[:i - 5] + (value,) + self.extra[i - 4:]
+        else:
+            raise IndexError(f"IndexedRow assignment index {i} is out of range")
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        if isinstance(other, IndexedRow):
+            other = other.to_list()
+        return self.to_list() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def __reduce__(self):
+        return (IndexedRow, (self.index, self.original, self.texts, self.stags, self.etags, self.translation, self.extra))
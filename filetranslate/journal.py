@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+journal
+~~~~~~~
+
+Checkpoints of partially translated databases.
+
+Every translated batch is appended to a per-file journal as soon as MTL returns it,
+so a run that dies on a ban, an exception or Ctrl-C continues from the last completed
+batch. The journal header stores a hash of the database and the translation options;
+a journal that doesn't match them is discarded.
+"""
+__version__ = '0.1.1'
+
+import os, json, hashlib
+
+JOURNAL_VERSION = 1
+
+
+class TranslationJournal():
+    """ Append-only JSON lines journal: a header followed by {row index: translated lines} records.
+        Used as a context manager it's closed (but not removed) on leaving the block.
+    """
+    def __init__(self, journal_dir, file_name, header):
+        self.path = os.path.join(journal_dir,
+            hashlib.md5(os.path.abspath(file_name).encode('utf-8')).hexdigest() + ".jsonl")
+        self.header = dict(header, version=JOURNAL_VERSION)
+        self._file = None
+
+    def load(self):
+        """ Returns the journaled rows if the journal belongs to the same database and options """
+        rows = dict()
+        if not os.path.isfile(self.path):
+            return rows
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            if not lines or json.loads(lines[0]) != self.header:
+                return dict()
+            for line in lines[1:]:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # the last record was cut by a crash
+                rows.update((int(i), tl) for i, tl in record.items())
+        except (OSError, ValueError):
+            return dict()
+        return rows
+
+    def open(self, rows=None):
+        """ Starts a new journal with the already known rows """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._write(self.header)
+        if rows:
+            self._write(rows)
+
+    def append(self, rows):
+        if self._file is None:
+            self.open()
+        self._write(rows)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close() # the journal itself stays for the next run
+        return False
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
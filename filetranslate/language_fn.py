@@ -1,6 +1,7 @@
-import re
+import re, heapq
 #from random import random
 from hashlib import sha1
+from dictionary_fn import trie_pattern
 
 MIN_REPEATS_IN_SFX = 2
 MIN_SFX_SENTENCES = 2
@@ -67,6 +68,9 @@ KANA_SFX_RE = re.compile(r'\b[%s%s]+\b' % (KANA_SFX, PUNCTUATION_JP), re.U)
 FULLWIDTH_TO_NORMAL = str.maketrans('ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ１２３４５６７８９０。、：！', 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz1234567890.,:!')
 
 def unreplace_tags(text, tags_list, lang='JA'):
+    """ Replaces MTL tags of replacement_tags.csv (and their variants mangled by MTL) back to the originals.
+        Use TagUnreplacer to do it for many texts.
+    """
     fixed = text
     for line in tags_list:
         orig = line[0]
@@ -85,6 +89,62 @@ def unreplace_tags(text, tags_list, lang='JA'):
             fixed = fixed.replace(tag.lower()[:-1], orig)
     return fixed
         
+class TagUnreplacer():
+    """ Same as unreplace_tags, but the tag variants are compiled once for the tag list:
+        one scan of a text finds the tag rows it contains and only those rows are replaced.
+    """
+    def __init__(self, tags_list, lang='JA'):
+        self.rows = [] # (original, [variants of the tag in the order they are replaced])
+        self.always = set() # rows with an empty variant, it's found anywhere
+        key_rows = dict()
+        for n, line in enumerate(tags_list):
+            orig = line[0]
+            tag = line[1]
+            keys = [tag]
+            if lang == 'JA':
+                tag = tag.translate(FULLWIDTH_TO_NORMAL)
+            keys += [tag, (tag[0].upper() + tag[1:]), tag.upper(), tag.lower()]
+            if len(orig) > 2 and (tag[-1:] in PUNCTUATION_EN):
+                #sometimes MTLs gulp-down punctuation
+                keys += [tag[:-1], tag.upper()[:-1], tag.lower()[:-1]]
+            self.rows.append((orig, keys))
+            for key in keys:
+                if key: key_rows.setdefault(key, set()).add(n)
+                else: self.always.add(n)
+        # a match is the longest variant at its position; shorter ones there are its prefixes
+        self.prefix_rows = {key: frozenset().union(*(key_rows.get(key[:i], ()) for i in range(1, len(key) + 1)))
+                            for key in key_rows}
+        self.regex = re.compile('(?=(' + trie_pattern(sorted(key_rows, key=len, reverse=True)) + '))') if key_rows else None
+
+    def _rows_in(self, text):
+        rows = set()
+        if self.regex:
+            for m in self.regex.finditer(text):
+                rows.update(self.prefix_rows[m.group(1)])
+        return rows
+
+    def sub(self, text):
+        """ Applies the tag rows found in the text in their order; a replacement that makes
+            a variant of a later row (original text contains it) brings the row in.
+        """
+        pending = self._rows_in(text) | self.always
+        queue = sorted(pending)
+        heapq.heapify(queue)
+        while queue:
+            n = heapq.heappop(queue)
+            orig, keys = self.rows[n]
+            fixed = text
+            for key in keys:
+                fixed = fixed.replace(key, orig)
+            if fixed != text:
+                text = fixed
+                for later in self._rows_in(text) - pending:
+                    if later > n:
+                        pending.add(later)
+                        heapq.heappush(queue, later)
+        return text
+
+
 def tag_hash(string, str_enc="utf-8", hash_len=7, use_digits=False, lang='JA'):
     """ Generates short English tags for MTL from any kind of string.
     """
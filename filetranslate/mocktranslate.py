@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+mocktranslate
+~~~~~~~~~~~~~
+
+Deterministic offline translator for benchmarks and tests.
+
+Translation of a line is the line itself prefixed with the destination language,
+so results can be checked. Latency, cost and failures are simulated with
+a seeded random generator; options can be set in the constructor or in
+the FILETRANSLATE_MOCK environment variable, e.g.
+    FILETRANSLATE_MOCK="latency=0.2,failure_rate=0.05,seed=1" filetranslate -t mock
+"""
+__version__ = '0.1.0'
+
+import os, asyncio, random
+from mtlbackend import TranslatorBackend
+from ratelimit import RateLimits
+
+MOCK_OPTIONS_ENV = "FILETRANSLATE_MOCK"
+
+
+class MockTranslationError(Exception):
+    pass
+
+
+class MockTranslate(TranslatorBackend):
+    """ Local mock backend.
+
+    :param latency: Seconds per request.
+    :param latency_per_char: Additional seconds per sent character.
+    :param cost_per_million_chars: Simulated price for the cost report.
+    :param failure_rate: Probability of a request to fail (and be retried).
+    :param ban_rate: Probability of a failure to look like a ban (HTTP 429).
+    :param mismatch_rate: Probability of a reply with a missing line.
+    :param chars_per_window: Character budget per 60s window (0: unlimited).
+    :param seed: Seed of the failures.
+    """
+    name = "mock"
+    char_limit = 2000
+    max_concurrency = 4
+
+    def __init__(self, latency=0.0, latency_per_char=0.0, cost_per_million_chars=0.0, failure_rate=0.0,
+                 ban_rate=0.0, mismatch_rate=0.0, chars_per_window=0, seed=0, **kwargs):
+        options = dict(latency=latency, latency_per_char=latency_per_char,
+                       cost_per_million_chars=cost_per_million_chars, failure_rate=failure_rate, ban_rate=ban_rate,
+                       mismatch_rate=mismatch_rate, chars_per_window=chars_per_window, seed=seed)
+        options.update(self.options_from_env())
+        options.update(kwargs)
+        super().__init__(options.pop("max_concurrency", None))
+        if "char_limit" in options:
+            self.char_limit = int(options.pop("char_limit"))
+        self.latency = float(options["latency"])
+        self.latency_per_char = float(options["latency_per_char"])
+        self.cost_per_million_chars = float(options["cost_per_million_chars"])
+        self.failure_rate = float(options["failure_rate"])
+        self.ban_rate = float(options["ban_rate"])
+        self.mismatch_rate = float(options["mismatch_rate"])
+        self.chars_per_window = int(options["chars_per_window"])
+        self.random = random.Random(options["seed"])
+        self.requests = 0
+        self.chars = 0
+
+    @staticmethod
+    def options_from_env():
+        """ Parses name=value,... options of FILETRANSLATE_MOCK """
+        options = dict()
+        for item in filter(None, os.environ.get(MOCK_OPTIONS_ENV, '').split(',')):
+            name, _, value = item.partition('=')
+            options[name.strip()] = value.strip()
+        if "max_concurrency" in options:
+            options["max_concurrency"] = int(options["max_concurrency"])
+        return options
+
+    def get_rate_limits(self):
+        return RateLimits(chars_per_window=self.chars_per_window)
+
+    @staticmethod
+    def translate_line(line, src='JA', dest='EN'):
+        return f"{dest}:{line}" if line.strip() else line
+
+    async def translate_lines(self, lines, src, dest):
+        n_chars = sum(len(line) + 1 for line in lines)
+        self.requests += 1
+        self.chars += n_chars
+        delay = self.latency + self.latency_per_char * n_chars
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            if self.ban_rate and self.random.random() < self.ban_rate:
+                raise MockTranslationError("429 Too Many Requests")
+            raise MockTranslationError("Mock request failed")
+        result = [self.translate_line(line, src, dest) for line in lines]
+        if self.mismatch_rate and self.random.random() < self.mismatch_rate:
+            result = result[:-1]
+        return result
+
+    def translate_text(self, text, src='JA', dest='EN'):
+        return '\n'.join(self.translate_line(line, src, dest) for line in text.split('\n'))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+mtlbackend
+~~~~~~~~~~
+
+Asynchronous interface of machine translation backends.
+
+Every backend exposes `async translate_batch(lines, src, dest)` that returns
+one translated line per source line. The number of requests in flight is limited
+by `max_concurrency`, so while a backend waits for its budget or for a reply
+the other files are preprocessed and looked up in the cache.
+
+Backends declare their request limits and cost as class attributes and are
+registered by name with a "module:Class" path (built-in ones below, others in
+the "filetranslate.backends" entry point group); a module is imported only
+when its backend is selected.
+"""
+__version__ = '0.2.0'
+
+import asyncio, threading, importlib
+from importlib.metadata import entry_points
+from ratelimit import RateLimits
+
+ENTRY_POINT_GROUP = "filetranslate.backends"
+# name => ("module:Class", constructor options); the order gives -t numbers
+BACKENDS = {
+    "googlet": ("mtlbackend:GoogleBackend", {}),
+    "sugoi": ("sugoitranslate:SugoiTranslate", {"by_line": True}),
+    "mock": ("mocktranslate:MockTranslate", {}), # offline, for benchmarks and tests
+    "sugoi-int8": ("sugoitranslate:SugoiTranslate", {"by_line": True, "quantize": True}),
+    "sugoi-mp": ("sugoitranslate:SugoiTranslate", {"by_line": True, "workers": 0}), # replica per 4 CPU cores
+    "sugoi-server": ("sugoitranslate:SugoiTranslate", {"by_line": True, "server": True}), # see sugoiserver.py
+}
+
+
+class TranslatorBackend():
+    """ Base class of MTL backends.
+
+    Subclasses implement either blocking `translate_text` (it's run in a worker thread)
+    or the `translate_lines` coroutine for natively asynchronous services.
+    """
+    name = "backend"
+    char_limit = 2000 # maximal number of characters in one request
+    batch_limit = 0 # maximal number of lines in one request (0: unlimited)
+    supports_batching = True # several lines can be sent in one request
+    max_concurrency = 1 # maximal number of requests in flight
+    cost_per_million_chars = 0.0
+
+    def __init__(self, max_concurrency=None):
+        if max_concurrency:
+            self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+    def get_char_limit(self):
+        """ Maximal number of characters sent in one batch """
+        return self.char_limit
+
+    def get_batch_limit(self):
+        """ Maximal number of lines sent in one batch (0: unlimited) """
+        return self.batch_limit if self.supports_batching else 1
+
+    def estimate_cost(self, n_chars):
+        return n_chars * self.cost_per_million_chars / 1e6
+
+    def get_rate_limits(self):
+        """ Character and request budgets per time window (unlimited by default) """
+        return RateLimits()
+
+    async def translate_batch(self, lines, src, dest):
+        """ Translates a list of lines.
+
+        :param lines: Source lines without linebreaks.
+        :param src: Two-letter source language code.
+        :param dest: Two-letter destination language code.
+        :return: List of translated lines.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await self.translate_lines(lines, src, dest)
+
+    async def translate_lines(self, lines, src, dest):
+        text = await asyncio.to_thread(self.translate_text, '\n'.join(lines), src, dest)
+        return text.splitlines()
+
+    def translate_text(self, text, src, dest):
+        raise NotImplementedError(f"{type(self).__name__} doesn't implement translation")
+
+
+class GoogleBackend(TranslatorBackend):
+    """ Google translation with googletrans (both its blocking 3.x and asynchronous 4.x APIs).
+
+    MTL bans you if you free-use it faster than N (>5000) chars per T (>10) sec.
+    """
+    name = "googlet"
+    char_limit = 2000
+
+    def __init__(self, **kwargs):
+        super().__init__(kwargs.pop("max_concurrency", None))
+        from googletrans import Translator
+        self.translator = Translator(raise_exception=True, **kwargs)
+
+    def get_rate_limits(self):
+        return RateLimits(chars_per_window=5000, requests_per_window=5, window=30.0)
+
+    async def translate_lines(self, lines, src, dest):
+        text = '\n'.join(lines)
+        if asyncio.iscoroutinefunction(self.translator.translate):
+            result = await self.translator.translate(text, src=src, dest=dest)
+        else:
+            result = await asyncio.to_thread(self.translator.translate, text, src=src, dest=dest)
+        return result.text.splitlines()
+
+
+def available_backends():
+    """ Returns {name: ("module:Class", options)} of built-in and installed backends without importing them """
+    backends = dict(BACKENDS)
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        backends.setdefault(ep.name, (ep.value, {}))
+    return backends
+
+
+def resolve_backend_name(selector):
+    """ Returns backend name by its name or 1-based number in available_backends() """
+    backends = available_backends()
+    if isinstance(selector, int) or str(selector).isdigit():
+        names = list(backends)
+        n = int(selector) - 1
+        if n < 0 or n >= len(names):
+            raise ValueError(f"Unknown translator {selector}; available: {format_backends(backends)}")
+        return names[n]
+    if selector not in backends:
+        raise ValueError(f"Unknown translator {selector}; available: {format_backends(backends)}")
+    return selector
+
+
+def format_backends(backends=None):
+    return ','.join(f"{n}={name}" for n, name in enumerate(backends or available_backends(), 1))
+
+
+def load_backend_class(selector):
+    """ Imports the module of the selected backend and returns its class """
+    target, _ = available_backends()[resolve_backend_name(selector)]
+    module_name, _, class_name = target.partition(':')
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    if not issubclass(backend_class, TranslatorBackend):
+        raise TypeError(f"{target} is not a TranslatorBackend")
+    return backend_class
+
+
+def load_backend(selector, **kwargs):
+    """ Creates backend instance with its registered options updated by kwargs """
+    _, options = available_backends()[resolve_backend_name(selector)]
+    return load_backend_class(selector)(**dict(options, **kwargs))
+
+
+def describe_backend(backend):
+    """ Returns short description of backend (class or instance) capabilities """
+    batch_limit = backend.batch_limit if backend.supports_batching else 1
+    return (f"{backend.char_limit} chars" + (f"/{batch_limit} lines" if batch_limit else '') +
+            f" per request, {backend.max_concurrency} in flight" +
+            (f", ${backend.cost_per_million_chars:g}/1M chars" if backend.cost_per_million_chars else ''))
+
+
+class EventLoopThread():
+    """ Runs an asyncio event loop in a background thread.
+
+    Synchronous code, like `translateCSV` running in several -jobs threads,
+    submits backend coroutines to the loop and blocks only its own thread.
+    """
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        if self.loop is not None: return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="mtl-event-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        """ Runs a coroutine in the loop and returns its result """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        if self.loop is None: return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+ratelimit
+~~~~~~~~~
+
+Token-bucket rate limiting of MTL requests.
+
+Backends describe their budgets with `RateLimits` (characters and requests per window),
+`RateLimiter` spends them, retries failed requests with exponential backoff and jitter
+and pauses much longer only when an error looks like a ban.
+"""
+__version__ = '0.1.0'
+
+import asyncio, random, time
+from collections import namedtuple
+
+# zero means unlimited
+RateLimits = namedtuple("RateLimits", ["chars_per_window", "requests_per_window", "window"], defaults=[0, 0, 60.0])
+
+BACKOFF_BASE_DELAY = 2.0
+BACKOFF_MAX_DELAY = 5 * 60
+BAN_BASE_DELAY = 10 * 60
+BAN_MAX_DELAY = 60 * 60
+BACKOFF_JITTER = 0.5 # part of the delay that's randomized
+BAN_STATUS_CODES = (403, 429)
+BAN_MARKERS = ("too many requests", "429", "unusual traffic", "captcha", "banned", "rate limit", "quota")
+LOG_THROTTLING_AFTER = 5.0 # seconds; longer waits are printed
+
+
+def is_ban_error(exc):
+    """ Checks if an exception looks like the service refuses to serve us (HTTP 429/403, captcha etc.) """
+    for obj in (exc, getattr(exc, "response", None)):
+        status = getattr(obj, "status_code", None) or getattr(obj, "status", None)
+        if isinstance(status, int) and status in BAN_STATUS_CODES:
+            return True
+    text = str(exc).lower()
+    return any(marker in text for marker in BAN_MARKERS)
+
+
+class TokenBucket():
+    """ Bucket of `capacity` tokens refilled evenly over `window` seconds.
+
+    Tokens can go negative when a single request is bigger than the bucket,
+    the debt is then paid by waiting.
+    """
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, amount, now):
+        """ Returns seconds to wait until `amount` tokens can be spent """
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed: return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+
+class RateLimiter():
+    """ Shared request budget of a translation backend """
+    def __init__(self, limits=RateLimits(), name='', ban_max_delay=BAN_MAX_DELAY):
+        self.name = name
+        self.limits = limits
+        self.ban_max_delay = ban_max_delay
+        self.char_bucket = TokenBucket(limits.chars_per_window, limits.window) if limits.chars_per_window else None
+        self.request_bucket = TokenBucket(limits.requests_per_window, limits.window) if limits.requests_per_window else None
+        self.blocked_until = 0.0
+        self.n_failures = 0 # consecutive ones
+        self.n_bans = 0 # escalates ban pauses, decays after successful requests
+        self.total_bans = 0
+        self.throttled_time = 0.0
+        self.backoff_time = 0.0
+
+    async def acquire(self, n_chars):
+        """ Waits until the budget allows a request with `n_chars` characters and spends it """
+        while True:
+            now = time.monotonic()
+            delay = max(self.blocked_until - now,
+                        self.char_bucket.delay(n_chars, now) if self.char_bucket else 0.0,
+                        self.request_bucket.delay(1, now) if self.request_bucket else 0.0)
+            if delay <= 0: break
+            if delay >= LOG_THROTTLING_AFTER:
+                print(f"{self.name}: throttled for {delay:.1f}s", end='\r', flush=True)
+            await asyncio.sleep(delay)
+            self.throttled_time += time.monotonic() - now
+        if self.char_bucket: self.char_bucket.consume(n_chars)
+        if self.request_bucket: self.request_bucket.consume(1)
+
+    def on_success(self):
+        self.n_failures = 0
+        if self.n_bans: self.n_bans = max(0, self.n_bans - 1)
+
+    def on_failure(self, exc):
+        """ Registers a failed request and returns seconds the backend is paused for """
+        self.n_failures += 1
+        if is_ban_error(exc):
+            self.n_bans += 1
+            self.total_bans += 1
+            delay = min(self.ban_max_delay, BAN_BASE_DELAY * 2 ** (self.n_bans - 1))
+        else:
+            delay = min(BACKOFF_MAX_DELAY, BACKOFF_BASE_DELAY * 2 ** (self.n_failures - 1))
+        delay = delay * (1 - BACKOFF_JITTER) + random.uniform(0, delay * BACKOFF_JITTER)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.backoff_time += delay
+        return delay
+
+    def report(self):
+        """ Returns text with the time spent waiting for the budget """
+        return (f"{self.name}: throttled {self.throttled_time:.1f}s" +
+                (f" (after errors {self.backoff_time:.1f}s, bans {self.total_bans})" if self.backoff_time else ''))
@@ -7,6 +7,7 @@ from time import sleep
 USE_COLORAMA = False
 TERMINAL_SIZE = 0
 PROGRESS_BAR_LEN = 0
+SHOW_PROGRESS = True
 try:
     TERMINAL_SIZE = (get_terminal_size().columns - 2) if stdin.isatty() else 0
     PROGRESS_BAR_LEN = TERMINAL_SIZE - 20
@@ -148,6 +149,11 @@ def make_same_size(inp_str: str, orig_len: int, enc: str, filler_char: str="\0")
     assert len(s.encode(enc)) == orig_len
     return s
 
+def set_progress_enabled(enabled=True):
+    """ Enables or disables progress bar output (it's garbled when several files are processed at once) """
+    global SHOW_PROGRESS
+    SHOW_PROGRESS = enabled
+
 def print_progress(index, total, type_of_progress=0, start_from=0, end_with=100, title=''):
     """ Prints progress bar
 
@@ -158,7 +164,7 @@ def print_progress(index, total, type_of_progress=0, start_from=0, end_with=100,
     end_with ending percent
     title header of the progressbar
     """
-    if TERMINAL_SIZE == 0 or PROGRESS_BAR_LEN < 10:
+    if not SHOW_PROGRESS or TERMINAL_SIZE == 0 or PROGRESS_BAR_LEN < 10:
         return
 
     if index > total: index = total
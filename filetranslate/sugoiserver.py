@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+sugoiserver
+~~~~~~~~~~~
+
+Local Sugoi inference server shared by filetranslate runs.
+
+The model is loaded once; lines sent by concurrent clients during a short
+window are joined into one deduplicated batch, so several projects translated
+at once share both the memory and the batching. Clients are `SugoiTranslate`
+instances created with `server=` (the `sugoi-server` translator).
+
+Usage: python sugoiserver.py [-host 127.0.0.1] [-port 14367] [-workers N] [-quantize]
+
+API (JSON over localhost HTTP):
+    POST /translate {"lines": [...]} -> {"translations": [...]}
+    POST /translate {"text": "..."} -> {"translation": "..."}
+    GET /health -> {"name": ..., "requests": ..., "batches": ..., "lines": ...}
+"""
+__version__ = '0.1.1'
+
+import os, sys, json, time, queue, threading, argparse
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 14367
+DEFAULT_MAX_WAIT = 0.02 # seconds to wait for other clients after the first request of a batch
+DEFAULT_MAX_LINES = 512 # lines in one dynamic batch
+
+
+class DynamicBatcher():
+    """ Joins lines of concurrent requests into deduplicated batches for one translate function.
+
+        A batch is translated after max_wait seconds from its first request, when it has max_lines
+        lines or on flush(); with max_wait None only the last two end it.
+    """
+    def __init__(self, translate_lines, max_wait=DEFAULT_MAX_WAIT, max_lines=DEFAULT_MAX_LINES):
+        self.translate_lines = translate_lines
+        self.max_wait = max_wait
+        self.max_lines = max_lines
+        self.requests = 0
+        self.batches = 0
+        self.lines = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sugoi-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, lines):
+        """ Returns Future with translations of the lines """
+        future = Future()
+        self._queue.put((lines, future))
+        return future
+
+    def flush(self):
+        """ Translates the requests submitted so far without waiting for more """
+        self._queue.put(None)
+
+    def _collect(self):
+        item = self._queue.get()
+        while item is None: # nothing to flush
+            item = self._queue.get()
+        items = [item]
+        n_lines = len(item[0])
+        deadline = None if self.max_wait is None else time.monotonic() + self.max_wait
+        while n_lines < self.max_lines:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0: break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None: break # flush()
+            items.append(item)
+            n_lines += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            unique = list(dict.fromkeys(line for lines, _ in items for line in lines))
+            try:
+                results = dict(zip(unique, self.translate_lines(unique))) if unique else dict()
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.requests += len(items)
+            self.batches += 1
+            self.lines += len(unique)
+            for lines, future in items:
+                future.set_result([results[line] for line in lines])
+
+
+class SugoiRequestHandler(BaseHTTPRequestHandler):
+    server_version = f"sugoiserver/{__version__}"
+
+    def _reply(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._reply(404, {"error": "not found"})
+        batcher = self.server.batcher
+        self._reply(200, {"name": self.server.model.name, "requests": batcher.requests,
+                          "batches": batcher.batches, "lines": batcher.lines})
+
+    def do_POST(self):
+        if self.path != "/translate":
+            return self._reply(404, {"error": "not found"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            if "lines" in request:
+                self._reply(200, {"translations": self.server.batcher.submit(request["lines"]).result()})
+            else:
+                with self.server.model_lock: # whole texts aren't batched
+                    self._reply(200, {"translation": self.server.model.translate(request["text"])})
+        except Exception as e:
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(model, host=DEFAULT_HOST, port=DEFAULT_PORT, max_wait=DEFAULT_MAX_WAIT, max_lines=DEFAULT_MAX_LINES):
+    """ Creates HTTP server for an entered translator with `translate_lines_batched` """
+    server = ThreadingHTTPServer((host, port), SugoiRequestHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.model_lock = threading.Lock()
+    def translate_lines(lines):
+        with server.model_lock:
+            return model.translate_lines_batched(lines)
+    server.batcher = DynamicBatcher(translate_lines, max_wait, max_lines)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Sugoi translation server for filetranslate")
+    parser.add_argument("-host", default=DEFAULT_HOST, help=f"Address to listen on (def: {DEFAULT_HOST})")
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (def: {DEFAULT_PORT})")
+    parser.add_argument("-workers", type=int, default=1, help="Model replicas in separate processes (0: auto)")
+    parser.add_argument("-quantize", action="store_true", help="Use int8-quantized model")
+    parser.add_argument("-wait", type=float, default=DEFAULT_MAX_WAIT, help="Seconds to wait for other clients' lines")
+    args = parser.parse_args()
+
+    from sugoitranslate import SugoiTranslate
+    print("Loading Sugoi model...")
+    with SugoiTranslate(by_line=True, quantize=args.quantize, workers=args.workers) as model:
+        server = make_server(model, args.host, args.port, args.wait)
+        print(f"Serving {model.name} on http://{args.host}:{args.port} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+if __name__ == "__main__":
+    main()
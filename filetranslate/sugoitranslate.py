@@ -24,11 +24,17 @@ filetranslate/
         dict.ja.txt
         LICENSE
         ...
+
+With `server=` set (the `sugoi-server` translator) it's a thin client of sugoiserver.py
+that keeps the model loaded for all runs.
 """
 __version__ = '0.0.1'
 
-import os, re
-from fairseq.models.transformer import TransformerModel
+import os, re, json, multiprocessing
+import urllib.request, urllib.error
+from concurrent.futures import ProcessPoolExecutor
+from mtlbackend import TranslatorBackend
+from ratelimit import RateLimits
 
 class TranslationError(Exception):
     def __init__(self, message):
@@ -38,20 +44,72 @@ DEBUG = False
 
 NON_CHARACTERS_RE = re.compile(r'^[^\w_]+$', re.UNICODE)
 MULTIPLE_LINEFEEDS_RE = re.compile(r'\n+')
+ELLIPSIS_END_RE = re.compile(r'[…]+\s*$')
+ELLIPSIS_RE = re.compile(r'[…]+\s*')
+CONTROL_CHARS_RE = re.compile(r' ?[\u0000-\u0006]')
+REPETITIONS_RE = re.compile(r"(.)\1{10,}")
+AI_BRAIN_GLITCHES = [
+    ("? ?", '?'),
+    ("! !", '!'),
+    ("? !", '?!'),
+    ("! ?", '!?'),
+]
+DEFAULT_MAX_TOKENS = 4096 # source tokens in one batch including padding
+DEFAULT_WORKER_THREADS = 4 # torch intra-op threads of each worker process
+CHUNKS_PER_WORKER = 4 # smaller chunks even out the load of workers
+DEFAULT_SERVER = os.environ.get("SUGOI_SERVER", "http://127.0.0.1:14367")
+SERVER_TIMEOUT = 30 * 60 # seconds; a request can wait for long batches of other clients
+SERVER_CONCURRENCY = 8 # requests in flight to the server
+
+_worker = None # model replica of a worker process
+
 
+class SugoiTranslate(TranslatorBackend):
+    name = "sugoi"
+    char_limit = 65536 # batches are split by max_tokens anyway
 
-class SugoiTranslate():
     def __init__(self, src='JA', dest='EN', by_line=False,
-                 model_path=f"{os.path.dirname(__file__)}\\sugoi_v4model_fairseq"):
+                 model_path=f"{os.path.dirname(__file__)}\\sugoi_v4model_fairseq",
+                 max_tokens=DEFAULT_MAX_TOKENS, quantize=False, workers=1, threads=None, server=None):
         """ Sugoi translator init
 
         NOTE: It doesn't support other languages so don't init it with anything else.
+
+        :param by_line: Translate each line separately, in batches of lines with similar length.
+        :param max_tokens: Maximal number of sentencepiece tokens in one batch (including padding).
+        :param quantize: Use dynamic int8 quantization of linear layers (faster and smaller on CPU,
+            translations may differ slightly).
+        :param workers: Number of model replicas in separate processes (0: CPU count / threads).
+        :param threads: Torch intra-op threads of each replica (default: torch's own for one process,
+            CPU count / workers for several).
+        :param server: URL of sugoiserver.py to use instead of loading the model (True: SUGOI_SERVER
+            environment variable or http://127.0.0.1:14367).
         """
+        super().__init__()
         self.source_lang = src.lower()
         self.target_lang = dest.lower()
 
         self.max_chars = 1500
+        self.max_tokens = max_tokens
         self.by_line = by_line
+        self.quantize = quantize
+        if quantize:
+            self.name = "sugoi-int8" # its translations are remembered separately
+        n_cpus = os.cpu_count() or 1
+        if not workers:
+            workers = max(1, n_cpus // (threads or DEFAULT_WORKER_THREADS))
+        self.workers = workers
+        self.threads = threads # torch default if not set
+        self.max_concurrency = workers
+        self._pool = None
+        self.translator = None
+        if server is True:
+            server = DEFAULT_SERVER
+        self.server = server.rstrip('/') if server else None
+        if self.server:
+            self.max_concurrency = SERVER_CONCURRENCY
+        if not by_line:
+            self.char_limit = self.max_chars # whole text is one model input
         self.inputModelPathOnly = model_path
         self.inputModelNameWithoutPath = 'big.pretrain.pt'
         self.device = 'cpu'
@@ -67,6 +125,29 @@ class SugoiTranslate():
         self.no_repeat_ngram_size=3
 
     def __enter__(self, *args, **kwargs):
+        if self.server:
+            try:
+                with urllib.request.urlopen(self.server + "/health", timeout=10) as response:
+                    self.name = json.load(response)["name"] # e.g. sugoi-int8; memories read it on use
+            except (OSError, ValueError) as e:
+                raise TranslationError(f"Sugoi server at {self.server} isn't available ({e}); " +
+                                       "start it with: python sugoiserver.py")
+            return self
+        if self.workers > 1:
+            # every worker loads its own replica; the main process only distributes lines
+            self.threads = self.threads or max(1, (os.cpu_count() or 1) // self.workers)
+            options = dict(src=self.source_lang, dest=self.target_lang, by_line=self.by_line,
+                           model_path=self.inputModelPathOnly, max_tokens=self.max_tokens, quantize=self.quantize,
+                           threads=self.threads)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(options,))
+            # processes are started on demand, so all replicas are loaded before the first request
+            list(self._pool.map(_worker_ready, range(self.workers)))
+            return self
+        import torch
+        from fairseq.models.transformer import TransformerModel
+        if self.threads:
+            torch.set_num_threads(self.threads)
         self.translator = TransformerModel.from_pretrained(
             self.inputModelPathOnly,
             checkpoint_file=self.inputModelNameWithoutPath,
@@ -76,15 +157,24 @@ class SugoiTranslate():
             sentencepiece_model=self.sourceSentencePieceModel,
             no_repeat_ngram_size=self.no_repeat_ngram_size
         )
+        # fairseq splits its inputs by the same limit
+        self.translator.cfg.dataset.max_tokens = self.max_tokens
+        if self.quantize:
+            # weights of nn.Linear layers are stored in int8 and activations are quantized on the fly
+            self.translator.eval()
+            torch.quantization.quantize_dynamic(self.translator, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return self
 
     def __exit__(self, *args, **kwargs):
-        pass
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
 
-    def wait(self):
-        pass
+    def get_rate_limits(self):
+        return RateLimits() # local model isn't limited
 
-    def get_char_limit(self):
-        return 65536
+    def translate_text(self, text, src=None, dest=None):
+        return self.translate(text)
 
     def translate(self, text, *args, **kwargs):
         """ Translates a string.
@@ -99,39 +189,28 @@ class SugoiTranslate():
             raise TranslationError("Source text cannot be None.")
         elif text == '':
             return text
-        elif len(text) > self.max_chars:
+        elif len(text) > self.max_chars and not self.by_line:
             raise TranslationError(f"Text length is {len(text)} but translation limit is {self.max_chars}.")
-            
+        elif self.server and not self.by_line:
+            return self._post({"text": text})["translation"]
+        elif self._pool is not None and not self.by_line:
+            return self._pool.submit(_worker_translate, text).result()
+
         text = text.replace('\u2014', '\u30FC') #  BUG: — -> ー
 
         res_text_all = ''
         if self.by_line:
-            one_time_cache = dict()
-            lines = text.splitlines()
+            lines = [self._prepare_line(line) for line in text.splitlines()]
             for line in lines:
-                text = line.strip()
-                # fix sequences that baffle the neuronet
-                text = text.replace('\u3000', ' ')
-                text = re.compile(r'[…]+\s*$').sub('。', text) # ……$ -> 。$
-                text = re.compile(r'[…]+\s*').sub('… ', text) # "……" -> "…<space>"
-                text = re.compile(r' ?[\u0000-\u0006]').sub('', text)
-                if text and text in one_time_cache:
-                    res_text_all += one_time_cache[text] + '\n'
-                else:
-                    res = self.translator.translate(text).strip().replace('\n', ' ')
-                    aibrainglitches = [
-                        ("? ?", '?'),
-                        ("! !", '!'),
-                        ("? !", '?!'),
-                        ("! ?", '!?'),
-                    ]
-                    for bg, bgr in aibrainglitches:
-                        res = res.replace(bg, bgr)
-                    res = re.sub(r"(.)\1{10,}", '', res) # repetitive sub-sentences
-                    if DEBUG: print(text, "->", res)
-                    if text and res:
-                        one_time_cache[text] = res
-                    res_text_all += res + '\n'
+                if len(line) > self.max_chars:
+                    raise TranslationError(f"Line length is {len(line)} but translation limit is {self.max_chars}.")
+            # each unique line is translated once
+            one_time_cache = dict.fromkeys(line for line in lines if line)
+            unique_lines = list(one_time_cache)
+            for line, res in zip(unique_lines, self.translate_lines_batched(unique_lines)):
+                if DEBUG: print(line, "->", res)
+                one_time_cache[line] = res
+            res_text_all = ''.join((one_time_cache[line] if line else '') + '\n' for line in lines)
 
         else: # not by line
             # '…' char and utterances baffle the model somehow so it's better to preprocess them
@@ -147,3 +226,89 @@ class SugoiTranslate():
             res_text_all = self.translator.translate(text)
 
         return res_text_all
+
+    @staticmethod
+    def _prepare_line(line):
+        """ Fixes sequences that baffle the neuronet """
+        text = line.strip()
+        text = text.replace('\u3000', ' ')
+        text = ELLIPSIS_END_RE.sub('。', text) # ……$ -> 。$
+        text = ELLIPSIS_RE.sub('… ', text) # "……" -> "…<space>"
+        text = CONTROL_CHARS_RE.sub('', text)
+        return text
+
+    @staticmethod
+    def _fix_result(res):
+        res = res.strip().replace('\n', ' ')
+        for bg, bgr in AI_BRAIN_GLITCHES:
+            res = res.replace(bg, bgr)
+        return REPETITIONS_RE.sub('', res) # repetitive sub-sentences
+
+    def make_batches(self, lengths):
+        """ Groups indexes of sentences with similar token lengths into batches,
+            so that padded batch size doesn't exceed `max_tokens`.
+        """
+        batches = []
+        batch = []
+        batch_max_len = 0
+        for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+            max_len = max(batch_max_len, lengths[i])
+            if batch and max_len * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                max_len = lengths[i]
+            batch.append(i)
+            batch_max_len = max_len
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def translate_lines_batched(self, lines):
+        """ Translates prepared lines in length-bucketed batches, results keep the order of lines """
+        if self.server:
+            return self._post({"lines": lines})["translations"]
+        if self._pool is not None:
+            return self.translate_lines_in_pool(lines)
+        lengths = [len(self.translator.encode(line)) for line in lines]
+        results = [None] * len(lines)
+        for batch in self.make_batches(lengths):
+            translated = self.translator.translate([lines[i] for i in batch])
+            for i, res in zip(batch, translated):
+                results[i] = self._fix_result(res)
+        return results
+
+    def translate_lines_in_pool(self, lines):
+        """ Spreads lines sorted by length over the worker replicas, results keep the order of lines """
+        order = sorted(range(len(lines)), key=lambda i: len(lines[i]))
+        n_chunks = min(len(lines), self.workers * CHUNKS_PER_WORKER) or 1
+        chunks = [order[n * len(order) // n_chunks:(n + 1) * len(order) // n_chunks] for n in range(n_chunks)]
+        results = [None] * len(lines)
+        for chunk, translated in zip(chunks, self._pool.map(_worker_translate_lines,
+                                                            [[lines[i] for i in chunk] for chunk in chunks])):
+            for i, res in zip(chunk, translated):
+                results[i] = res
+        return results
+
+    def _post(self, request):
+        data = json.dumps(request, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(self.server + "/translate", data=data,
+                                     headers={"Content-Type": "application/json; charset=utf-8"})
+        try:
+            with urllib.request.urlopen(req, timeout=SERVER_TIMEOUT) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise TranslationError(f"Sugoi server error: {e.read().decode('utf-8', 'replace')}")
+
+
+def _init_worker(options):
+    global _worker
+    _worker = SugoiTranslate(**options).__enter__()
+
+def _worker_ready(_):
+    return os.getpid()
+
+def _worker_translate_lines(lines):
+    return _worker.translate_lines_batched(lines)
+
+def _worker_translate(text):
+    return _worker.translate(text)
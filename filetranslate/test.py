@@ -3,6 +3,17 @@ import unittest, os, re, datetime, tempfile, copy
 from filetranslate import *
 from language_fn import *
 from service_fn import *
+from ratelimit import *
+from translation_memory import *
+from dictionary_fn import *
+from mtlbackend import *
+from mocktranslate import *
+from indexed_row import IndexedRow
+from binary_fn import BinaryPatcher, find_all
+import filetranslate
+import threading
+from sugoiserver import make_server
+from sugoitranslate import SugoiTranslate
 #import tracemalloc
 #tracemalloc.start()
 
@@ -102,6 +113,382 @@ class TestServiceFunctions(unittest.TestCase):
             self.original_lines, self.translated_lines, self.translation_types, False
             ), self.translated_lines_match_original)
 
+    def test_index_segments(self):
+        segments = re.split(r'"([^"]*)"', 'a "x" b "y" c "x" d "x"')
+        positions = index_segments(segments)
+        self.assertEqual(list(positions["x"]), [1, 5, 7])
+        self.assertEqual(list(positions["y"]), [3])
+        self.assertEqual(positions["x"].popleft(), 1) # first unused occurrence
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, 10.0)
+        now = bucket.last
+        self.assertEqual(bucket.delay(60, now), 0)
+        bucket.consume(60)
+        self.assertAlmostEqual(bucket.delay(60, now), 2.0)
+        # requests bigger than the bucket wait only for a full one
+        self.assertAlmostEqual(bucket.delay(500, now), 6.0)
+
+    def test_backoff_and_bans(self):
+        self.assertTrue(is_ban_error(Exception("429 Too Many Requests")))
+        self.assertFalse(is_ban_error(TimeoutError("read timed out")))
+        limiter = RateLimiter(name="test")
+        self.assertLess(limiter.on_failure(TimeoutError()), BACKOFF_BASE_DELAY + 0.01)
+        self.assertGreaterEqual(limiter.on_failure(Exception("HTTP 429")), BAN_BASE_DELAY * (1 - BACKOFF_JITTER))
+        self.assertEqual(limiter.total_bans, 1)
+
+class TestTranslationMemory(unittest.TestCase):
+
+    def test_line_lookup(self):
+        store = dict()
+        tm = TranslationMemory(store, "mtl", "JA-EN")
+        tm.set_many(['ええと、 だが', 'ハァ'], ['Uh, but', 'Huh'])
+        self.assertEqual(tm.get_many(['ハァ', ' ええと、　だが ', 'ああ']), ['Huh', 'Uh, but', None])
+        self.assertEqual((tm.hits, tm.misses), (2, 1))
+        self.assertEqual(TranslationMemory(store, "other", "JA-EN").get_many(['ハァ']), [None])
+
+    def test_store_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = TranslationStore(os.path.join(tmp, "tm.sqlite3"), max_size=45)
+            tm = TranslationMemory(store, "mtl", "JA-EN")
+            tm.set_many(['ハァ', 'ええ'], ['Huh', 'Yes, yes'])
+            tm.set_many(['だが'], ['But'])
+            self.assertEqual(tm.get_many(['ハァ', 'ええ', 'だが']), ['Huh', 'Yes, yes', 'But'])
+            store._db.execute("UPDATE tm SET last_used = 0 WHERE source = 'ええ'")
+            tm.set_many(['そうですね'], ['I see'])
+            self.assertEqual(tm.get_many(['ええ', 'そうですね']), [None, 'I see'])
+            self.assertEqual((store.stats()["evicted"], store.size), (1, 38))
+            self.assertEqual(TranslationMemory(store, "mtl", "JA-RU").get_many(['ハァ']), [None])
+            stats = store.stats()
+            self.assertEqual((stats["hits"], stats["misses"]), (3, 2))
+            self.assertEqual(stats["namespaces"], [("mtl", "JA-EN", 3, 38, 3, 1)])
+            store.close()
+
+class TestReplacementDictionary(unittest.TestCase):
+
+    def test_same_as_sequential_sub(self):
+        entries = [['アリス', 'アリス[Alice]'], ['ボブ', 'ボブ[Bob]'], ['ス', 'su'], ['[0-9]+円', 'yen'],
+                   ['さん', ''], ['んだ', 'nda'], ['ab', 'b'], ['bb', 'c'], ['x', None]]
+        text = 'アリスさんだ、ボブさんは100円。スス abbb x\nアリス'
+        expected = text
+        for key, value in entries:
+            expected = re.sub(key, value or '', expected, flags=re.U)
+        d = ReplacementDictionary(entries)
+        self.assertEqual(d.sub(text), expected)
+        self.assertLess(len(d), len(entries))
+
+    def test_out_dictionary(self):
+        entries = [['^Mr ', 'Mr. '], ['Alice', 'Arisu'], ['', '-'], ['colour', 'color'], ['(\\d+) yen', '\\1 G'], ['  ', ' ']]
+        text = 'Mr  Alice has 10 yen\nMr colour'
+        out_dict = OutDictionary(entries)
+        for flags, skip_empty, result in ((re.U, True, out_dict.sub(text)), (re.M, True, out_dict.sub(text, multiline=True)),
+                                          (re.U, False, out_dict.sub_all(text))):
+            expected = text
+            for key, value in entries:
+                if key or not skip_empty:
+                    expected = re.sub(key, value, expected, flags=flags)
+            self.assertEqual(result, expected)
+
+class TestTagSplitter(unittest.TestCase):
+
+    def split_sequential(self, sentence, tags):
+        starttag = endtag = ''
+        all_tags = '(?:(?:' + '|'.join(re.escape(i[0]) for i in tags if i[0].strip(' 　')) + ')[ 　]*)+'
+        for i in tags:
+            if not i[0].strip(' 　') and sentence.startswith(i[0]):
+                starttag, sentence = i[0], sentence[len(i[0]):]
+        for _ in range(4):
+            m = re.search('^' + all_tags, sentence)
+            if m:
+                starttag, sentence = starttag + m[0], sentence.replace(m[0], '')
+                continue
+            m = re.search(all_tags + '$', sentence)
+            if m:
+                endtag, sentence = m[0] + endtag, sentence.replace(m[0], '')
+        for i in tags:
+            if i[0].strip(' 　'): sentence = sentence.replace(i[0], i[1])
+        return [starttag or None, sentence, endtag or None]
+
+    def test_same_as_sequential(self):
+        sentences = ['　\\c[1]「こんにちは\\n」\\c[0]', '<a<ab>テキスト<ab> \\V[1]', '  @1@テスト@1@2@', 'タグなし']
+        for tags in ([['　', ''], ['  ', ''], ['\\c[1]', '[c1]'], ['\\c[0]', '[c0]'], ['\\n', '[n]'],
+                      ['\\V[1]', '[v1]'], ['@1@', '[1]'], ['@2@', '[2]']],
+                     [['<a', '[a]'], ['<ab>', '[ab]'], ['\\c', '[c]'], ['[c]', 'C']]):
+            splitter = TagSplitter(tags)
+            for sentence in sentences:
+                self.assertEqual(splitter.split(sentence), self.split_sequential(sentence, tags))
+
+    def test_unreplace_same_as_sequential(self):
+        tags = [['\\c[1]', 'abcdefg,'], ['ナナ', 'abcdef,'], ['ハ', 'ｘｙｚ！'], ['\\V[12]', 'c[1]'], ['。', ',']]
+        texts = ['Abcdefg, ok', 'ABCDEFG ABCDEF, abcdef', 'xyz! XYZ Xyz', 'abcdefgabcdefg,', 'nothing', '']
+        unreplacer = TagUnreplacer(tags)
+        for text in texts:
+            self.assertEqual(unreplacer.sub(text), unreplace_tags(text, tags))
+
+class TestIndexedRow(unittest.TestCase):
+
+    def test_list_compatibility(self):
+        import pickle
+        for item in TestServiceFunctions.indexed_array:
+            row = IndexedRow.from_list(item)
+            self.assertEqual(row, item)
+            self.assertEqual([row[i] for i in range(len(item))], item)
+            self.assertEqual(row[5:], item[5:])
+            self.assertEqual(string_from_indexed_array_item(row, True), string_from_indexed_array_item(item, True))
+            self.assertEqual(pickle.loads(pickle.dumps(row)), item)
+        row = IndexedRow.from_lines(0, 'ああ', [[None, 'ああ', None]])
+        self.assertEqual((len(row), row.stags, row.texts[0] is row.original), (4, None, True))
+        self.assertRaises(IndexError, row.__getitem__, 4)
+
+    def test_parse_cache_key(self):
+        tags = TestServiceFunctions.tags_array
+        key = ParseCache.key("hash", TagSplitter(tags), False)
+        self.assertEqual(key, ParseCache.key("hash", TagSplitter(copy.deepcopy(tags)), False))
+        self.assertNotEqual(key, ParseCache.key("hash2", TagSplitter(tags), False))
+        self.assertNotEqual(key, ParseCache.key("hash", TagSplitter(tags[1:]), False))
+        self.assertNotEqual(key, ParseCache.key("hash", TagSplitter(tags), True))
+
+    def test_merge_flags(self):
+        rows = split_reader_to_array([['あいうえおか\nかきくけこさ。', ''], ['「たちつてと', ''], ['なにぬねのは', '']])
+        flags = make_merge_flags(rows, [(row.index, row.text()) for row in rows], r'[^。]$||^[（「]||[」）]$')
+        self.assertEqual(flags, {0: [False, False], 1: [True], 2: [False]})
+
+class TestAttributeLookup(unittest.TestCase):
+
+    samples = {
+        "tyrano": '[link text="はい"]\n#太郎\n[button text="いいえ"][link text="はい"]\n#花子\n',
+        "kirikiri": '[link text="はい"][emb exp="f.name" text="いいえ"]\n[link text="花子"]\n',
+        "kirikiri_tjs": 'var a = "はい";\nf("いいえ");\nvar b = "花子";\n',
+        "rpgmakermv": '{"name":"はい","description":"いいえ","message1":"花子",\n"params":["力","体","はい"]}\n',
+        "rpgmakerace_scripts": 'a = [ "はい", "いいえ", "花子"]\n',
+        "rpgmakerace_yaml": 'name: "はい"\ndescription: いいえ\nparams:\n - 力\n - 花子\n  basic: 1\n',
+        "godot_dialogic": '{"name": "はい",\n"choice": "いいえ",\n"value": "花子",\n}\n',
+        "resources": '  CAPTION "はい"\n  1, "いいえ"\n  2, "花子"\n',
+    }
+
+    def replace_sequential(self, text, re_a, re_a_sep, alines, strip_comments, drop_empty):
+        def block(match):
+            spans, current, original = [], 0, match[0]
+            found_groups = [(i, found) for i, found in enumerate(match.groups(), start=1) if found is not None]
+            if re_a_sep and re_a_sep.search(found_groups[0][1]):
+                return original.replace(found_groups[0][1], re_a_sep.sub(item, found_groups[0][1]))
+            for i, found in found_groups:
+                first, last = match.start(i) - match.start(), match.end(i) - match.start()
+                spans.append(original[current:first])
+                for row in alines:
+                    if strip_comments and row[0][:len(COMMENT_TAG)] == COMMENT_TAG and row[1][:len(COMMENT_TAG)] != COMMENT_TAG: continue
+                    if found == row[0]:
+                        if not row[1] and not drop_empty: break
+                        found = row[1]
+                spans.append(found)
+                current = last
+            return ''.join(spans) + original[current:]
+        def item(match):
+            for row in alines:
+                if match[1] and match[1] == row[0]:
+                    if row[1] == '' and not drop_empty: break
+                    return match[0].replace(match[1], row[1])
+            return match[0]
+        return re_a.sub(block, text)
+
+    def test_presets_byte_identical(self):
+        presets = read_csv_list(os.path.join(os.path.dirname(os.path.abspath(filetranslate.__file__)), GAME_REGEXP_DB))
+        tested = 0
+        for preset in presets:
+            if preset[0] not in self.samples: continue
+            ars = preset[3].split(TEXT_RE_SPLITTER)
+            re_a = re.compile(ars[0], re.MULTILINE)
+            re_a_sep = re.compile(ars[1]) if len(ars) > 1 else None
+            text = self.samples[preset[0]]
+            originals = []
+            for match in re_a.finditer(text):
+                for found in filter(None, match.groups()):
+                    if re_a_sep and re_a_sep.search(found):
+                        originals += [m[1] for m in re_a_sep.finditer(found) if m[1]]
+                    else:
+                        originals.append(found)
+            originals = list(dict.fromkeys(originals))
+            self.assertGreater(len(originals), 2, preset[0])
+            alines = [[original, "EN " + original] for original in originals]
+            alines[0][1] = '' # empty translation
+            alines[1][1] = originals[2] # translated again by the row of another original
+            alines += [[originals[2], "duplicate"], [COMMENT_TAG + originals[1], "comment"], ["EN", "not whole"]]
+            for drop_empty in (False, True):
+                with tempfile.TemporaryDirectory() as work_dir:
+                    FT = FileTranslate(work_dir=work_dir, img_exts=[], file_enc=preset[1], re_a=ars[0], re_s=None,
+                                       re_t=None, re_a_sep=ars[1] if len(ars) > 1 else None, re_excl=None, re_mque=None)
+                    file_name = os.path.join(work_dir, "file.txt")
+                    with open(file_name, 'wb') as f: f.write(text.encode(preset[1]))
+                    write_csv_list(os.path.join(work_dir, "file" + ATTRIBUTES_DB_POSTFIX), alines)
+                    self.assertTrue(FT.applyTranslationsToFile(file_name, drop_empty=drop_empty))
+                    with open(FT.getOutputName(file_name), 'rb') as f:
+                        expected = self.replace_sequential(text, re_a, re_a_sep,
+                            sort_by_first_column_length(alines), True, drop_empty)
+                        self.assertEqual(f.read(), expected.encode(preset[1]), preset[0])
+            tested += 1
+        self.assertEqual(tested, len(self.samples))
+
+class TestBinaryPatcher(unittest.TestCase):
+
+    def test_find_all(self):
+        positions = find_all(b'abc\0ab\0abc\0', [b'ab\0', b'abc\0', b'bc\0', b'c\0a', b'x'])
+        self.assertEqual(positions, {b'ab\0': [4], b'abc\0': [0, 7], b'bc\0': [1, 8], b'c\0a': [2], b'x': []})
+        self.assertEqual(find_all(b'aaa', [b'a', b'aa']), {b'a': [0, 1, 2], b'aa': [0, 1]})
+
+    def test_patches(self):
+        patcher = BinaryPatcher(b'abc\0xy\0abc\0bc\0')
+        patcher.add(b'abc\0', b'ABC\0') # two occurrences: first one
+        patcher.add(b'abc\0', b'DEF\0') # duplicate row takes the next one
+        patcher.add(b'bc\0', b'BC\0') # occurrences inside taken strings are passed over
+        patcher.add_at(4, b'xy\0', b'XY\0')
+        patcher.add_at(4, b'x', b'Z') # overlaps
+        patcher.add(b'zz', b'ZZ')
+        self.assertEqual(patcher.apply(), 4)
+        self.assertEqual(bytes(patcher.data), b'ABC\0XY\0DEF\0BC\0')
+        self.assertEqual([(offset, reason) for offset, _, reason in patcher.skipped],
+                         [(4, "overlaps another patch"), (None, "not found")])
+        self.assertEqual(len(patcher.ambiguous), 2)
+
+    def test_extract_and_apply(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_name = os.path.join(work_dir, "game.exe")
+            data = b'MZ\x01\0' + 'はいはい'.encode('cp932') + b'\0\x7f\0' + 'いいえいいえ'.encode('cp932') + b'\0' + 'はいはい'.encode('cp932') + b'\0'
+            with open(file_name, 'wb') as f: f.write(data)
+            FT = FileTranslate(work_dir=work_dir, img_exts=[], file_enc='cp932', re_a=None, re_s=None, re_t=None,
+                               re_a_sep=None, re_excl=None, re_mque=None)
+            self.assertEqual(FT.makeTranslatableStrings(file_name, lang="JA_ALL", is_binary=True), 3)
+            rows = read_csv_list(os.path.join(work_dir, "game" + STRINGS_DB_POSTFIX))
+            self.assertEqual([row[3] for row in rows], ['0x4,cp932,\\0,8', '0xf,cp932,\\0,12', '0x1c,cp932,\\0,8'])
+            rows[0][1], rows[1][1], rows[2][1] = 'Yes', 'No', 'Yes!'
+            rows[1][3] = rows[1][3][:-2] + '10' # stale length
+            write_csv_list(os.path.join(work_dir, "game" + STRINGS_DB_POSTFIX), rows)
+            self.assertTrue(FT.applyTranslationsToBinary(file_name))
+            with open(FT.getOutputName(file_name), 'rb') as f:
+                self.assertEqual(f.read(), data.replace('はいはい'.encode('cp932'), b'Yes\0\0\0\0\0', 1).replace(
+                    'はいはい'.encode('cp932'), b'Yes!\0\0\0\0'))
+
+    def test_bad_length_skipped(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_name = os.path.join(work_dir, "game.exe")
+            data = b'MZ\x01\0' + 'はいはい'.encode('cp932') + b'\0' + 'いいえいいえ'.encode('cp932') + b'\0'
+            with open(file_name, 'wb') as f: f.write(data)
+            FT = FileTranslate(work_dir=work_dir, img_exts=[], file_enc='cp932', re_a=None, re_s=None, re_t=None,
+                               re_a_sep=None, re_excl=None, re_mque=None)
+            write_csv_list(os.path.join(work_dir, "game" + STRINGS_DB_POSTFIX),
+                           [['はいはい', 'Yes', '', '0x4,cp932,\\0,8?'], ['いいえいいえ', 'No', '', '0xd,cp932,\\0,12']])
+            self.assertTrue(FT.applyTranslationsToBinary(file_name))
+            with open(FT.getOutputName(file_name), 'rb') as f:
+                self.assertEqual(f.read(), data.replace('いいえいいえ'.encode('cp932'), b'No' + b'\0' * 10))
+
+    def test_upgrade_keeps_place(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_name = os.path.join(work_dir, "game.exe")
+            with open(file_name, 'wb') as f: f.write(b'MZ\x01\0' + 'はいはい'.encode('cp932') + b'\0')
+            FT = FileTranslate(work_dir=work_dir, img_exts=[], file_enc='cp932', re_a=None, re_s=None, re_t=None,
+                               re_a_sep=None, re_excl=None, re_mque=None)
+            FT.makeTranslatableStrings(file_name, lang="JA_ALL", is_binary=True)
+            write_csv_list(os.path.join(work_dir, "game" + STRINGS_DB_POSTFIX),
+                           [['はいはい', 'Yes', '', '0x4,cp932,\\x20,8']])
+            with open(file_name, 'wb') as f: f.write(b'MZ\x01\0\x7f\0' + 'はいはい'.encode('cp932') + b'\0')
+            FT.makeTranslatableStrings(file_name, upgrade=True, lang="JA_ALL", is_binary=True)
+            self.assertEqual(read_csv_list(os.path.join(work_dir, "game" + STRINGS_DB_POSTFIX)),
+                             [['はいはい', 'Yes', '', '0x6,cp932,\\x20,8']])
+
+class TestBackendRegistry(unittest.TestCase):
+
+    def test_resolve_and_split(self):
+        self.assertEqual(resolve_backend_name(2), "sugoi")
+        self.assertEqual(resolve_backend_name("googlet"), "googlet")
+        self.assertRaises(ValueError, resolve_backend_name, "nonexistent")
+
+        class LineBackend(TranslatorBackend):
+            char_limit = 10
+            batch_limit = 2
+        service = TranslationService(LineBackend(), '.')
+        self.assertEqual(service._split_request(['aaa', 'bb', 'c', 'dddddddd', 'e']),
+                         [['aaa', 'bb'], ['c'], ['dddddddd'], ['e']])
+        LineBackend.supports_batching = False
+        self.assertEqual(len(service._split_request(['a', 'b', 'c'])), 3)
+
+class TestMockPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.old_dir = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.enable_cache = filetranslate.ENABLE_CACHE
+        filetranslate.ENABLE_CACHE = False
+        self.ft = FileTranslate(work_dir=self.tmp.name, img_exts=[], file_enc='utf-8', re_a=None, re_s=None,
+                                re_t=None, re_a_sep=None, re_excl=None, re_mque=None)
+        self.csv = os.path.join(self.tmp.name, "a_strings.csv")
+        write_csv_list(self.csv, [['はい。', ''], ['いいえ。\nそうだ。', ''], ['はい。', '']])
+
+    def tearDown(self):
+        filetranslate.ENABLE_CACHE = self.enable_cache
+        os.chdir(self.old_dir)
+        self.tmp.cleanup()
+
+    def test_translate_csv(self):
+        backend = MockTranslate(seed=1)
+        memory = TranslationMemory(dict(), backend.name, "JA-EN")
+        with TranslationService(backend, self.tmp.name, memory=memory) as trn_svc:
+            self.assertEqual(self.ft.translateCSV(trn_svc, self.csv, True), 3)
+        self.assertEqual([row[1] for row in read_csv_list(self.csv)],
+                         ['EN:はい。', 'EN:いいえ。そうだ。', 'EN:はい。'])
+        self.assertEqual((backend.requests, memory.misses), (1, 3))
+
+    def test_line_count_mismatch(self):
+        with TranslationService(MockTranslate(mismatch_rate=1.0), self.tmp.name) as trn_svc:
+            self.assertRaises(Exception, self.ft.translateCSV, trn_svc, self.csv, True)
+        self.assertEqual([row[1] for row in read_csv_list(self.csv)], ['', '', ''])
+
+class TestSugoiServer(unittest.TestCase):
+
+    class UpperModel():
+        name = "upper"
+        def __init__(self):
+            self.calls = []
+        def translate_lines_batched(self, lines):
+            self.calls.append(lines)
+            return [line.upper() for line in lines]
+
+    def test_client_batches(self):
+        model = self.UpperModel()
+        # the batch is ended by flush() after both requests are queued instead of a timeout
+        server = make_server(model, port=0, max_wait=None)
+        submitted = threading.Semaphore(0)
+        submit = server.batcher.submit
+        def counted_submit(lines):
+            future = submit(lines)
+            submitted.release()
+            return future
+        server.batcher.submit = counted_submit
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = "http://%s:%d" % server.server_address
+            client = SugoiTranslate(by_line=True, server=url)
+            memory = TranslationMemory(dict(), client, "JA-EN") # made before the server renames the client
+            with client:
+                self.assertEqual(client.name, "upper")
+                self.assertEqual(memory.backend_name, "upper")
+                results = [None, None]
+                def run(n, text):
+                    results[n] = client.translate(text)
+                threads = [threading.Thread(target=run, args=(0, "abc\n\nde")),
+                           threading.Thread(target=run, args=(1, "de\nf"))]
+                for t in threads: t.start()
+                for _ in threads: self.assertTrue(submitted.acquire(timeout=10))
+                server.batcher.flush()
+                for t in threads: t.join()
+            self.assertEqual(results, ["ABC\n\nDE\n", "DE\nF\n"])
+            self.assertEqual(len(model.calls), 1)
+            self.assertEqual(sorted(model.calls[0]), ["abc", "de", "f"])
+        finally:
+            server.shutdown()
+            server.server_close()
+
 # ---------------------------------------------------------------------------------------------------------------------------
 
 """
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+translation_memory
+~~~~~~~~~~~~~~~~~~
+
+Translation memory of single lines and merged segments.
+
+Entries are keyed by the normalized source text sent to MTL, the backend name
+and the language pair, so changed batch boundaries or a single edited line
+don't invalidate translations of the other lines.
+
+`TranslationStore` keeps them in an SQLite database shared by all projects
+(~/.filetranslate/ or the FILETRANSLATE_TM path) with a size cap and LRU eviction.
+"""
+__version__ = '0.2.2'
+
+import os, sqlite3, threading, time
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024 # bytes of source and target texts
+EVICT_TO = 0.9 # part of the size cap left after eviction
+SQL_CHUNK = 500 # number of parameters per IN (...) query
+STORE_SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS tm (
+    backend TEXT NOT NULL,
+    lang_pair TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (backend, lang_pair, source)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tm_last_used ON tm (last_used);
+CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def default_store_path():
+    """ Returns FILETRANSLATE_TM environment variable or ~/.filetranslate/translation_memory.sqlite3 """
+    return os.environ.get("FILETRANSLATE_TM") or os.path.join(
+        os.path.expanduser('~'), ".filetranslate", "translation_memory.sqlite3")
+
+
+class TranslationStore():
+    """ Persistent (backend, language pair, normalized source) -> target store with LRU eviction.
+
+    It's safe to use from several threads; every batch is committed at once.
+    """
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_store_path()
+        self.max_size = max_size
+        self.evicted = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript(STORE_SCHEMA)
+        self.size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tm").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _select(self, backend, lang_pair, sources, columns):
+        for n in range(0, len(sources), SQL_CHUNK):
+            chunk = sources[n:n + SQL_CHUNK]
+            yield from self._db.execute(
+                f"SELECT source, {columns} FROM tm WHERE backend = ? AND lang_pair = ? AND source IN " +
+                f"({','.join('?' * len(chunk))})", [backend, lang_pair] + chunk)
+
+    def get_many(self, backend, lang_pair, sources):
+        """ Returns {source: target} for the sources found and marks them as recently used """
+        sources = list(dict.fromkeys(sources))
+        with self._lock:
+            found = dict(self._select(backend, lang_pair, sources, "target"))
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE tm SET hits = hits + 1, last_used = ? WHERE backend = ? AND lang_pair = ? AND source = ?",
+                    [(now, backend, lang_pair, source) for source in found])
+            if len(found) < len(sources):
+                self._add_stat(f"misses:{backend}:{lang_pair}", len(sources) - len(found))
+            if sources:
+                self._db.commit()
+        return found
+
+    def _add_stat(self, name, value):
+        self._db.execute("INSERT INTO stats (name, value) VALUES (?, ?) " +
+                         "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, value))
+
+    def set_many(self, backend, lang_pair, pairs):
+        """ Stores (source, target) pairs and evicts the least recently used entries over the size cap """
+        pairs = dict(pairs)
+        if not pairs: return
+        now = time.time()
+        rows = [(backend, lang_pair, source, target, len(source.encode('utf-8')) + len(target.encode('utf-8')), now)
+                for source, target in pairs.items()]
+        with self._lock:
+            replaced = sum(size for _, size in self._select(backend, lang_pair, list(pairs), "size"))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tm (backend, lang_pair, source, target, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                rows)
+            self.size += sum(row[4] for row in rows) - replaced
+            if self.max_size and self.size > self.max_size:
+                self._evict(self.size - int(self.max_size * EVICT_TO))
+            self._db.commit()
+
+    def _evict(self, n_bytes):
+        cutoff = self._db.execute(
+            "SELECT last_used FROM (SELECT last_used, SUM(size) OVER (ORDER BY last_used) AS freed FROM tm) " +
+            "WHERE freed >= ? LIMIT 1", (n_bytes,)).fetchone()
+        if cutoff is None: return
+        freed, count = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM tm WHERE last_used <= ?", cutoff).fetchone()
+        self._db.execute("DELETE FROM tm WHERE last_used <= ?", cutoff)
+        self._add_stat("evicted", count)
+        self.size -= freed
+        self.evicted += count
+
+    def stats(self):
+        """ Returns dictionary with total and per backend/language pair numbers """
+        with self._lock:
+            namespaces = self._db.execute(
+                "SELECT backend, lang_pair, COUNT(*), SUM(size), SUM(hits) FROM tm GROUP BY backend, lang_pair " +
+                "ORDER BY backend, lang_pair").fetchall()
+            counters = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+        # misses of the namespaces whose entries were all evicted are counted in the total only
+        namespaces = [ns + (counters.get(f"misses:{ns[0]}:{ns[1]}", 0),) for ns in namespaces]
+        return {
+            "path": self.path,
+            "entries": sum(ns[2] for ns in namespaces),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": sum(ns[4] for ns in namespaces),
+            "misses": sum(value for name, value in counters.items() if name.startswith("misses:")),
+            "evicted": counters.get("evicted", 0),
+            "namespaces": namespaces
+        }
+
+    def report(self):
+        st = self.stats()
+        lines = [f"Translation memory: {st['path']}",
+                 f"  {st['entries']} entries, {st['size'] / 1024**2:.1f} of {st['max_size'] / 1024**2:.0f} MiB, " +
+                 f"{st['hits']} hits, {st['misses']} misses, {st['evicted']} evicted"]
+        for backend, lang_pair, count, size, hits, misses in st["namespaces"]:
+            lines.append(f"  {backend} {lang_pair}: {count} entries, {size / 1024**2:.1f} MiB, {hits} hits, {misses} misses")
+        return '\n'.join(lines)
+
+
+class TranslationMemory():
+    """ Line-level translation memory on top of a TranslationStore or a key-value store (diskcache.Cache or a dict) """
+    def __init__(self, store, backend='', lang_pair='', expire=None, exact=False):
+        self.store = store
+        # namespace name or a translator whose name is read on use (it may change when it's entered)
+        self.backend = backend
+        self.lang_pair = lang_pair
+        self.expire = expire
+        self.exact = exact # keys aren't normalized (whole database rows with their line structure)
+        self.hits = 0
+        self.misses = 0
+        # translateCSV runs in several threads with -jobs
+        self._lock = store._lock if isinstance(store, TranslationStore) else threading.Lock()
+
+    @property
+    def backend_name(self):
+        return getattr(self.backend, "name", self.backend)
+
+    @staticmethod
+    def normalize(text):
+        """ Makes cache key text: whitespace runs are collapsed and stripped """
+        return ' '.join(text.split())
+
+    def _source(self, text):
+        return text if self.exact else self.normalize(text)
+
+    def _key(self, text):
+        return ("tm", self.backend_name, self.lang_pair, self._source(text))
+
+    def get_many(self, sources):
+        """ Returns list of translations for the sources with None for misses """
+        if self.store is None:
+            with self._lock:
+                self.misses += len(sources)
+            return [None] * len(sources)
+        if isinstance(self.store, TranslationStore):
+            keys = [self._source(text) for text in sources]
+            known = self.store.get_many(self.backend_name, self.lang_pair, keys)
+            found = [known.get(key) for key in keys]
+        else:
+            found = [self.store.get(self._key(text)) for text in sources]
+        n_hits = sum(1 for item in found if item is not None)
+        with self._lock:
+            self.hits += n_hits
+            self.misses += len(found) - n_hits
+        return found
+
+    def set_many(self, sources, translations):
+        if self.store is None: return
+        if isinstance(self.store, TranslationStore):
+            self.store.set_many(self.backend_name, self.lang_pair,
+                ((self._source(text), translation) for text, translation in zip(sources, translations)))
+            return
+        for text, translation in zip(sources, translations):
+            if hasattr(self.store, "set"):
+                self.store.set(self._key(text), translation, expire=self.expire)
+            else:
+                self.store[self._key(text)] = translation
+
+    def report(self):
+        return f"Translation memory ({self.backend_name}): {self.hits} hits, {self.misses} misses"